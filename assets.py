@@ -0,0 +1,195 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from gamemaps import MapRenderer, default_map_color_scheme, iter_levels
+from palette import PaletteStore, WolfPal, SodPal, palette_image
+from sound import digi_sample_rate, resample_sounds, wav_bytes
+from util import AssetError
+from version_defs import *
+from vgagraph import (VGAContext, iter_pictures, map_vga_files, picture_palette, read_chunk, read_font, read_palettes,
+                      read_tile8)
+from vswap import iter_sounds, iter_sprites, iter_walls, Img_ExpandPaletteArray
+
+# Decoded assets kept in memory. Loaders collect the iter_* generators of the format modules, which
+# share their decoders with the extraction stages. They return plain arrays that outlive the files
+# and raise AssetError, printing nothing.
+# Writing files is left to the caller: image(), rgba() and wav() give PIL images and WAV bytes ready to save.
+
+
+@dataclass
+class Level:
+    index: int
+    name: str
+    planes: np.ndarray  # (3, height, width) uint16: tiles, things and the unused third plane
+    ceiling_color: np.ndarray
+    floor_color: np.ndarray
+
+    @property
+    def tiles(self):
+        return self.planes[0]
+
+    @property
+    def things(self):
+        return self.planes[1]
+
+    def thumbnail(self, color_scheme=default_map_color_scheme, scale=1):
+        return Image.fromarray(MapRenderer(color_scheme, scale).render(list(self.planes)), 'RGB')
+
+
+@dataclass
+class Wall:
+    index: int  # VSWAP page, every second wall is the shaded variant of the one before
+    indices: np.ndarray  # (64, 64) palette indices
+    palette: np.ndarray
+
+    @property
+    def name(self):
+        return f"{self.index // 2}_shaded" if self.index % 2 else f"{self.index // 2}"
+
+    def image(self, indexed=False):
+        return palette_image(self.indices, self.palette, indexed)
+
+
+@dataclass
+class Sprite:
+    index: int  # shape number
+    name: str
+    indices: np.ndarray  # (64, 64) palette indices, 255 is transparent
+    palette: np.ndarray
+
+    @property
+    def mask(self):
+        return self.indices != 255
+
+    def rgba(self, bleed=1):
+        return Img_ExpandPaletteArray(self.indices, 64, 64, self.palette, True, bleed)
+
+    def image(self, indexed=False, bleed=1):
+        if indexed:
+            return palette_image(self.indices, self.palette, True, transparent=255)
+        return Image.fromarray(self.rgba(bleed), 'RGBA')
+
+
+@dataclass
+class Sound:
+    index: int  # digitized sound number
+    name: Optional[str]
+    samples: np.ndarray  # 8-bit unsigned mono PCM
+    rate: int = digi_sample_rate
+
+    def resample(self, rate, sample_format="int16"):
+        return resample_sounds([self.samples], self.rate, rate, sample_format)[0]
+
+    def wav(self, rate=None, sample_format="int16"):
+        if rate is None:
+            return wav_bytes(self.samples, self.rate, "u8")
+        return wav_bytes(self.resample(rate, sample_format), rate, sample_format)
+
+
+@dataclass
+class Picture:
+    index: int  # picture number
+    name: str
+    indices: np.ndarray  # (height, width) palette indices
+    palette: np.ndarray
+
+    def image(self, indexed=False):
+        return palette_image(self.indices, self.palette, indexed)
+
+
+@dataclass
+class Font:
+    name: str
+    height: int
+    glyphs: Dict[str, np.ndarray]  # character -> (height, width) mask, non-zero pixels are set
+
+
+@dataclass
+class VSwapAssets:
+    walls: List[Wall] = field(default_factory=list)
+    sprites: List[Sprite] = field(default_factory=list)
+    sounds: List[Sound] = field(default_factory=list)
+
+
+@dataclass
+class VGAAssets:
+    pictures: List[Picture] = field(default_factory=list)
+    fonts: List[Font] = field(default_factory=list)
+    palettes: Dict[str, np.ndarray] = field(default_factory=dict)
+    tile8: Optional[np.ndarray] = None  # (35, 8, 8) palette indices
+    endscreens: Dict[str, bytes] = field(default_factory=dict)
+    endarts: Dict[str, bytes] = field(default_factory=dict)
+    demos: Dict[str, bytes] = field(default_factory=dict)
+
+
+def load_levels(maphead_path: Path, gamemaps_path: Path):
+    spear = is_spear_file(Path(maphead_path))
+    palette = SodPal if spear else WolfPal
+    ceiling_colors = sod_ceilings_colors if spear else wl6_ceilings_colors
+
+    levels = []
+    for level, name, planes in iter_levels(maphead_path, gamemaps_path):
+        if level >= len(ceiling_colors):
+            raise AssetError(f"Level {level} ({name}) has no ceiling color")
+        levels.append(Level(level, name, planes, palette[ceiling_colors[level]], palette[floor_color]))
+    return levels
+
+
+def load_vswap(vswap_path: Path):
+    palette = SodPal if is_spear_file(Path(vswap_path)) else WolfPal
+    return VSwapAssets(
+        walls=[Wall(i, indices, palette) for i, _, indices in iter_walls(vswap_path)],
+        sprites=[Sprite(shapenum, name, indices, palette) for shapenum, name, indices in iter_sprites(vswap_path)],
+        sounds=[Sound(soundnum, name, samples) for soundnum, name, samples in iter_sounds(vswap_path)],
+    )
+
+
+def load_vga(dict_path: Path, header_path: Path, vga_path: Path):
+    spear = is_spear_file(Path(dict_path))
+    palette = SodPal if spear else WolfPal
+    names = gen_vgagraph_name_lookup_table(wl6=not spear, sod=spear)
+    layout = VGAChunkLayout(sod_vga_type_range_map if spear else wl6_vga_type_range_map, names)
+
+    def chunks(chunk_type):
+        return [chunk for chunk in layout.chunks.get(chunk_type, []) if chunk < ctx.TotalChunks]
+
+    assets = VGAAssets()
+    ctx = VGAContext()
+    map_vga_files(ctx, dict_path, header_path, vga_path)
+    with ctx:
+        store = PaletteStore()
+        for chunk, buf in read_palettes(ctx, layout):
+            assets.palettes[names[chunk]] = store.add_vga(names[chunk], buf)
+
+        for chunk in chunks(VGAChunkType.FONT):
+            height, font_chars = read_font(ctx, chunk)
+            assets.fonts.append(Font(names[chunk], height, {fc["letter"]: fc["buf"].copy() for fc in font_chars}))
+
+        for chunk in chunks(VGAChunkType.TILE8):
+            assets.tile8 = read_tile8(ctx, chunk)
+
+        for chunk_type, target in ((VGAChunkType.ENDSCREEN, assets.endscreens), (VGAChunkType.ENDART, assets.endarts),
+                                   (VGAChunkType.DEMO, assets.demos)):
+            for chunk in chunks(chunk_type):
+                target[names[chunk]] = bytes(read_chunk(ctx, chunk, chunk_type))
+
+    assets.pictures = [Picture(picnum, name, indices, picture_palette(picnum, spear, store, palette))
+                       for picnum, name, indices in iter_pictures(dict_path, header_path, vga_path)]
+    return assets
+
+
+def load_signon(sod=False):
+    input_path = Path(__file__).resolve().parent / ("signon_sod.bin" if sod else "signon_wl.bin")
+    try:
+        src = input_path.read_bytes()
+    except OSError as e:
+        raise AssetError(f"Unable to read signon screen: {e}") from e
+    if len(src) < 320 * 200:
+        raise AssetError(f"Signon screen too short: {input_path}")
+
+    indices = np.frombuffer(src, dtype=np.uint8, count=320 * 200).reshape((200, 320)).copy()
+    return Picture(0, "SIGNON", indices, SodPal if sod else WolfPal)
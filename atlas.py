@@ -0,0 +1,47 @@
+import math
+
+
+def next_pow2(n):
+    return 1 << max(0, (n - 1).bit_length())
+
+
+def shelf_pack(sizes, width, height, spacing=0):
+    # Place (w, h) boxes left to right on shelves, a new shelf starts below the tallest box
+    # of the previous one. Returns the (x, y) of every box, or None if they don't fit.
+    positions = []
+    x = y = shelf_height = 0
+    for w, h in sizes:
+        if x + w > width:
+            x = 0
+            y += shelf_height + spacing
+            shelf_height = 0
+        if x + w > width or y + h > height:
+            return None
+        positions.append((x, y))
+        x += w + spacing
+        shelf_height = max(shelf_height, h)
+    return positions
+
+
+def pack_pow2_square(sizes, spacing=0):
+    # Smallest power-of-two square atlas holding all boxes. Boxes are shelved tallest first,
+    # positions are returned in the order of sizes.
+    if not sizes:
+        return 1, []
+
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+    sorted_sizes = [sizes[i] for i in order]
+
+    area = sum((w + spacing) * (h + spacing) for w, h in sizes)
+    side = next_pow2(max(max(max(w, h) for w, h in sizes), math.isqrt(area)))
+
+    while True:
+        placed = shelf_pack(sorted_sizes, side, side, spacing)
+        if placed is not None:
+            break
+        side *= 2
+
+    positions = [None] * len(sizes)
+    for i, pos in zip(order, placed):
+        positions[i] = pos
+    return side, positions
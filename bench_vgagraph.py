@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import argparse
+import struct
+import time
+from pathlib import Path
+
+from vgagraph import VGAContext, File_VGA_OpenVgaFiles, File_HuffExpand, File_HuffCompile, File_HuffExpandTable
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VGAGRAPH Huffman decoding per chunk")
+    parser.add_argument('-i', '--input', type=str, required=True, help='Directory with game files')
+    parser.add_argument('-e', '--extension', type=str, default="WL6", help='Game file extension')
+    args = parser.parse_args()
+    input_path = Path(args.input)
+    ext = args.extension
+
+    ctx = VGAContext()
+    if not File_VGA_OpenVgaFiles(ctx, input_path / f"VGADICT.{ext}", input_path / f"VGAHEAD.{ext}",
+                                 input_path / f"VGAGRAPH.{ext}"):
+        return
+
+    t = time.perf_counter()
+    table = File_HuffCompile(ctx.hufftable)
+    print(f"Table compile: {(time.perf_counter() - t) * 1000:.1f} ms")
+    print()
+
+    data = ctx.FileName.read_bytes()
+    chunks = [n for n, o in enumerate(ctx.offset) if o != -1]
+    offsets = [ctx.offset[n] for n in chunks] + [len(data)]
+
+    print(f"{'chunk':>5} {'size':>7} {'bitwise':>10} {'table':>10} {'speedup':>8}")
+    total_bytes = total_bit = total_table = 0
+    for n, start, end in zip(chunks, offsets, offsets[1:]):
+        src = data[start:end]
+        expanded = struct.unpack('<L', src[:4])[0]
+        # TILE8 has no length prefix, skip anything without a sane size
+        if not 0 < expanded <= 0x10000:
+            continue
+        src = src[4:]
+
+        target_bit = bytearray(expanded)
+        t = time.perf_counter()
+        File_HuffExpand(src, target_bit, expanded, len(src), ctx.hufftable)
+        t_bit = time.perf_counter() - t
+
+        target_table = bytearray(expanded)
+        t = time.perf_counter()
+        File_HuffExpandTable(src, target_table, expanded, len(src), table)
+        t_table = time.perf_counter() - t
+
+        assert target_bit == target_table, f"Output mismatch in chunk {n}"
+
+        print(f"{n:>5} {expanded:>7} {expanded / t_bit / 1e6:>7.2f} MB/s {expanded / t_table / 1e6:>7.2f} MB/s "
+              f"{t_bit / t_table:>7.1f}x")
+        total_bytes += expanded
+        total_bit += t_bit
+        total_table += t_table
+
+    print()
+    print(f"Total: {total_bytes} bytes, bitwise {total_bytes / total_bit / 1e6:.2f} MB/s, "
+          f"table {total_bytes / total_table / 1e6:.2f} MB/s ({total_bit / total_table:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,278 @@
 #!/usr/bin/env python
 
 import argparse
+import json
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Dict, List
 
-from gamemaps import extract_maps
+from gamemaps import extract_maps, map_formats
+from manifest import ExtractManifest, manifest_name
+from tasks import Task, run_tasks, sharded_tasks
+from version_defs import spear_extensions, wl6_vga_type_range_map, sod_vga_type_range_map, range_to_array
 from vgagraph import extract_vga
 from vswap import extract_vswap
 from signon import extract_signon
 
+# Base names of the data files of one game, the extension tells the variant (WL1, WL6, SOD, SDM, ...)
+game_file_names = ["MAPHEAD", "GAMEMAPS", "VSWAP", "VGADICT", "VGAHEAD", "VGAGRAPH"]
+
+
+@dataclass
+class GameDir:
+    input_path: Path
+    output_path: Path
+    label: str = ""  # Prefix of task names, empty for a single game
+    ext: str = ""
+    files: Dict[str, Path] = field(default_factory=dict)  # base name -> path
+    stages: List[str] = field(default_factory=list)
+    notes: List[str] = field(default_factory=list)
+
+    @property
+    def spear(self):
+        return f".{self.ext.lower()}" in spear_extensions
+
+    def file(self, name):
+        return self.files[name]
+
+    @property
+    def input_bytes(self):
+        return sum(path.stat().st_size for path in self.files.values())
+
+
+def vga_chunk_count(range_map):
+    return max(max(range_to_array(chunk_type, range_map)) for chunk_type in range_map) + 1
+
+
+def detect_game(input_path: Path, output_path: Path):
+    # Picks the most common data file extension in the directory, then checks which stages
+    # the files support. VGA layouts are only known for WL6 and SOD, the header size tells
+    # whether a directory (or a mod) matches them.
+    game = GameDir(input_path, output_path)
+    if not input_path.is_dir():
+        game.notes.append("not a directory")
+        return game
+
+    found = {}
+    # Files are referenced by absolute path, independent of the working directory
+    for path in input_path.resolve().iterdir():
+        stem, ext = path.stem.upper(), path.suffix[1:].upper()
+        if stem in game_file_names and path.is_file():
+            found.setdefault(ext, {})[stem] = path
+    if not found:
+        game.notes.append("no game data files")
+        return game
+
+    game.ext = Counter({ext: len(files) for ext, files in found.items()}).most_common(1)[0][0]
+    game.files = found[game.ext]
+
+    if "MAPHEAD" in game.files and "GAMEMAPS" in game.files:
+        game.stages.append("maps")
+    else:
+        game.notes.append("maps: MAPHEAD/GAMEMAPS missing")
+
+    if "VSWAP" in game.files:
+        game.stages.append("vswap")
+    else:
+        game.notes.append("vswap: VSWAP missing")
+
+    if all(name in game.files for name in ["VGADICT", "VGAHEAD", "VGAGRAPH"]):
+        chunks = vga_chunk_count(sod_vga_type_range_map if game.spear else wl6_vga_type_range_map)
+        # Some releases store an end offset after the last chunk
+        head_chunks = game.file("VGAHEAD").stat().st_size // 3
+        if head_chunks in (chunks, chunks + 1):
+            game.stages.append("vga")
+        else:
+            game.notes.append(f"vga: unknown layout, {head_chunks} chunks")
+    else:
+        game.notes.append("vga: VGADICT/VGAHEAD/VGAGRAPH missing")
+
+    game.stages.append("signon")
+    return game
+
+
+def read_manifest(manifest_path: Path):
+    # One game directory per line, optionally followed by a tab and its output directory
+    entries = []
+    for line in manifest_path.read_text().splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        input_dir, _, output_dir = line.partition("\t")
+        entries.append((Path(input_dir.strip()), Path(output_dir.strip()) if output_dir.strip() else None))
+    return entries
+
+
+def output_paths(entries, output_root: Path):
+    # A single game extracts into the output root, several get one subdirectory each
+    if len(entries) == 1:
+        return [output or output_root for _, output in entries]
+
+    paths, used = [], Counter()
+    for input_path, output in entries:
+        if output is None:
+            name = input_path.resolve().name or "game"
+            used[name] += 1
+            output = output_root / (name if used[name] == 1 else f"{name}_{used[name]}")
+        paths.append(output)
+    return paths
+
+
 def main():
     parser = argparse.ArgumentParser(description="Extract Wolfenstein3D assets")
-    parser.add_argument('-i', '--input', type=str, required=True, help='Directory with game files')
+    parser.add_argument('-i', '--input', type=str, nargs='+', default=[], help='Directories with game files')
+    parser.add_argument('--manifest', type=str,
+                        help='File listing game directories, one per line, optionally followed by a tab and an output directory')
+    parser.add_argument('-o', '--output', type=str, default=".",
+                        help='Output directory, with several games one subdirectory per game')
+    parser.add_argument('--report', type=str, help='Write a JSON summary of the run')
+    parser.add_argument('--force', action='store_true',
+                        help=f'Rewrite all outputs, even those {manifest_name} lists as unchanged')
+    parser.add_argument('--thumb-scale', type=int, default=1, help='Upscale factor for map thumbnails')
+    parser.add_argument('--map-format', choices=map_formats, default="json", help='Output format of map planes')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes, larger stages are split into as many tasks')
+    parser.add_argument('--sprite-bleed', type=int, default=1, help='Pixels of color bleed around sprite edges')
+    parser.add_argument('--indexed', action='store_true', help='Write palette-mode PNGs instead of RGB/RGBA')
+    parser.add_argument('--vswap-atlas', action='store_true', help='Pack walls and sprites into atlases with a JSON index')
+    parser.add_argument('--sound-rate', type=int, choices=[22050, 44100],
+                        help='Resample digitized sounds (default: original 7042 Hz 8-bit)')
+    parser.add_argument('--sound-format', choices=['int16', 'float'], default='int16',
+                        help='Sample format of resampled sounds')
+    parser.add_argument('--writers', type=int, default=4, help='Threads per task encoding and writing output files (0: inline)')
+    parser.add_argument('--queue-depth', type=int, default=64, help='Maximum number of pending output files per task')
     args = parser.parse_args()
-    input_path = Path(args.input)
 
-    extract_maps(input_path / "MAPHEAD.WL6", input_path / "GAMEMAPS.WL6")
-    print()
-    extract_vswap(input_path / "VSWAP.WL6")
+    entries = [(Path(path), None) for path in args.input]
+    if args.manifest:
+        entries += read_manifest(Path(args.manifest))
+    if not entries:
+        parser.error("no input, use -i or --manifest")
+
+    games = [detect_game(input_path, output_path.resolve())
+             for (input_path, _), output_path in zip(entries, output_paths(entries, Path(args.output)))]
+    if len(games) > 1:
+        for n, game in enumerate(games):
+            game.label = f"{n + 1}:{game.input_path.name}"
+
+    tasks = []
+    for game in games:
+        print(f"{game.input_path}: {game.ext or '?'} -> {game.output_path}"
+              + (f" ({'; '.join(game.notes)})" if game.notes else ""))
+        tasks += extraction_tasks(game, args, shards=max(args.jobs, 1) if len(games) == 1 else 1)
     print()
-    extract_vga(input_path / "VGADICT.WL6", input_path / "VGAHEAD.WL6", input_path / "VGAGRAPH.WL6")
+
+    t = time.perf_counter()
+    results = run_tasks(tasks, args.jobs, args.writers, args.queue_depth, show_logs=len(games) == 1,
+                        incremental=True, force=args.force)
+    wall_time = time.perf_counter() - t
+    save_manifests(games, results)
+
+    report = batch_report(games, results, wall_time)
     print()
-    extract_signon(sod=False)
+    for job in report["games"]:
+        status = "ok" if job["ok"] else "FAILED"
+        print(f"{status:>6} {job['input']} [{job['variant'] or '?'}] {job['seconds']:.2f} s, "
+              f"{job['throughput_mb_s']:.2f} MB/s" + (f", failed: {', '.join(job['failed'])}" if job["failed"] else ""))
+    total = report["total"]
+    print(f"Total: {total['games'] - total['failed_games']}/{total['games']} games, "
+          f"{total['tasks'] - total['failed_tasks']}/{total['tasks']} tasks done in {total['seconds']:.2f} s, "
+          f"{total['throughput_mb_s']:.2f} MB/s")
+
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, indent=1))
+
+    if total["failed_games"]:
+        sys.exit(1)
+
+
+def save_manifests(games, results):
+    # Tasks only read the manifest, their entries are merged here once all have finished
+    for game in games:
+        entries = {}
+        for result in results:
+            if result.group == game.label:
+                entries.update(result.outputs)
+        if entries:
+            ExtractManifest(game.output_path / manifest_name).save(entries)
+
+
+def batch_report(games, results, wall_time):
+    by_game = {}
+    for result in results:
+        by_game.setdefault(result.group, []).append(result)
+
+    jobs = []
+    for game in games:
+        game_results = by_game.get(game.label, [])
+        failed = [result.name for result in game_results if not result.ok]
+        seconds = sum(result.seconds for result in game_results)
+        input_bytes = game.input_bytes if game.files else 0
+        jobs.append({
+            "input": str(game.input_path),
+            "output": str(game.output_path),
+            "variant": game.ext,
+            "stages": game.stages,
+            "notes": game.notes,
+            "tasks": len(game_results),
+            "failed": failed,
+            # No data files is a failure too
+            "ok": bool(game.files) and not failed,
+            "seconds": seconds,
+            "input_bytes": input_bytes,
+            "throughput_mb_s": input_bytes / seconds / 1e6 if seconds else 0.0,
+        })
+
+    input_bytes = sum(job["input_bytes"] for job in jobs)
+    return {
+        "games": jobs,
+        "total": {
+            "games": len(jobs),
+            "failed_games": sum(not job["ok"] for job in jobs),
+            "tasks": len(results),
+            "failed_tasks": sum(not result.ok for result in results),
+            "seconds": wall_time,
+            "input_bytes": input_bytes,
+            "throughput_mb_s": input_bytes / wall_time / 1e6 if wall_time else 0.0,
+        },
+    }
+
+
+def extraction_tasks(game: GameDir, args, shards=1):
+    # Stages read disjoint files and write disjoint output trees. The larger ones are split
+    # into shards tasks, those go first so the pool isn't left waiting on them.
+    tasks = []
+    common = dict(output_root=game.output_path, group=game.label)
+
+    if "maps" in game.stages:
+        tasks += sharded_tasks("maps", extract_maps, shards, maphead_path=game.file("MAPHEAD"),
+                               gamemaps_path=game.file("GAMEMAPS"), thumb_scale=args.thumb_scale,
+                               map_format=args.map_format, **common)
+
+    if "vswap" in game.stages:
+        vswap_args = dict(vswap_path=game.file("VSWAP"), sprite_bleed=args.sprite_bleed, indexed=args.indexed,
+                          atlas=args.vswap_atlas, sound_rate=args.sound_rate, sound_format=args.sound_format)
+        if args.vswap_atlas:
+            tasks.append(Task("vswap atlas", extract_vswap, dict(vswap_args, parts=["walls", "sprites"]), **common))
+        else:
+            tasks += sharded_tasks("vswap sprites", extract_vswap, shards, parts=["sprites"], **vswap_args, **common)
+            tasks.append(Task("vswap walls", extract_vswap, dict(vswap_args, parts=["walls"]), **common))
+
+    if "vga" in game.stages:
+        vga_args = dict(dict_path=game.file("VGADICT"), header_path=game.file("VGAHEAD"),
+                        vga_path=game.file("VGAGRAPH"), indexed=args.indexed)
+        tasks += sharded_tasks("vga pictures", extract_vga, shards, parts=["pictures"], **vga_args, **common)
+
+    if "vswap" in game.stages:
+        tasks.append(Task("vswap sounds", extract_vswap, dict(vswap_args, parts=["sounds"]), **common))
+    if "vga" in game.stages:
+        tasks.append(Task("vga misc", extract_vga, dict(vga_args, parts=["misc"]), **common))
+    if "signon" in game.stages:
+        tasks.append(Task("signon", extract_signon, dict(sod=game.spear, indexed=args.indexed), **common))
+    return tasks
+
 
-            
 if __name__ == "__main__":
     main()
@@ -1,12 +1,20 @@
+import base64
+import io
 import json
 import math
+import mmap
 import struct
+from array import array
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 
 import numpy as np
 from PIL import Image
 
-from palette import RGB, WolfPal, SodPal
+from palette import WolfPal, SodPal
+from util import AssetError, close_map, data_errors, shard_range, select_indices
+from writer import OutputWriter
 from version_defs import *
 
 def File_CarmackExpand(src):
@@ -14,157 +22,351 @@ def File_CarmackExpand(src):
     src = memoryview(src)
     expanded_len = struct.unpack_from("<H", src, 0)[0]
     src = src[2:]
-    dest = []
+    length = expanded_len // 2
+    # A back-reference may run past the expected length, leave room for one
+    dest = array("H", bytes((length + 0xFF) * 2))
+    pos = 0
     i = 0
-    while len(dest) < expanded_len // 2:
-        ch = struct.unpack_from("<H", src, i)[0]
+    while pos < length:
+        ch = src[i] | (src[i + 1] << 8)
         i += 2
         chhigh = ch >> 8
-        if chhigh == NEARTAG:
+        if chhigh == NEARTAG or chhigh == FARTAG:
             count = ch & 0xFF
             if count == 0:
-                ch |= src[i]
+                dest[pos] = ch | src[i]
                 i += 1
-                dest.append(ch)
-            else:
-                offset = src[i]
-                i += 1
-                for _ in range(count):
-                    dest.append(dest[-offset])
-        elif chhigh == FARTAG:
-            count = ch & 0xFF
-            if count == 0:
-                ch |= src[i]
+                pos += 1
+                continue
+            if chhigh == NEARTAG:
+                start = pos - src[i]
                 i += 1
-                dest.append(ch)
             else:
-                offset = struct.unpack_from("<H", src, i)[0]
+                start = src[i] | (src[i + 1] << 8)
                 i += 2
-                for j in range(count):
-                    dest.append(dest[offset + j])
+            if not 0 <= start < pos:
+                raise IndexError(f"Carmack back-reference out of range: {start}")
+            # Overlapping copies repeat the source run, so copy in growing blocks
+            while count > 0:
+                n = min(count, pos - start)
+                dest[pos:pos + n] = dest[start:start + n]
+                pos += n
+                count -= n
         else:
-            dest.append(ch)
+            dest[pos] = ch
+            pos += 1
+    del dest[pos:]
     return dest
 
 
 def File_RLEWexpand(src_words, rlew_tag):
-    out = []
-    i = 0
-    while i < len(src_words):
-        value = src_words[i]
-        i += 1
-        if value != rlew_tag:
-            out.append(value)
+    words = np.asarray(src_words, dtype=np.uint16)
+
+    # A run's count or value word may itself equal the tag, so candidates
+    # covered by a preceding run are not tags
+    tags = []
+    next_free = 0
+    for t in np.flatnonzero(words == rlew_tag).tolist():
+        if t >= next_free:
+            tags.append(t)
+            next_free = t + 3
+    tags = np.array(tags, dtype=np.intp)
+
+    # Every literal word repeats once, every tag repeats its value word
+    values = words.copy()
+    repeats = np.ones(len(words), dtype=np.intp)
+    values[tags] = words[tags + 2]
+    repeats[tags] = words[tags + 1]
+    repeats[tags + 1] = 0
+    repeats[tags + 2] = 0
+
+    return np.repeat(values, repeats)
+
+
+def File_MAP_Expand(raw_bytes, rlew_tag, shape=(64, 64)):
+    carmacked = np.frombuffer(File_CarmackExpand(raw_bytes), dtype=np.uint16)
+    # skip 2-byte length prefix before RLEW
+    return File_RLEWexpand(carmacked[1:], rlew_tag).reshape(shape)
+
+
+# maptype in ID_CA.H: planestart[3], planelength[3], width, height, name[16]
+# followed by the "!ID!" signature
+map_header_dtype = np.dtype([
+    ("planestart", "<u4", 3),
+    ("planelength", "<u2", 3),
+    ("width", "<u2"),
+    ("height", "<u2"),
+    ("name", "S16"),
+    ("sig", "S4"),
+])
+
+
+@dataclass
+class GameMapsLevel:
+    archive: "GameMapsArchive"
+    index: int
+    name: str
+    width: int
+    height: int
+
+    def plane(self, n):
+        return self.archive.plane(self.index, n)
+
+
+class GameMapsArchive:
+    def __init__(self, maphead_path: Path, gamemaps_path: Path, cache_size=16):
+        maphead = Path(maphead_path).read_bytes()
+        self.rlew_tag = struct.unpack_from("<H", maphead, 0)[0]
+        if self.rlew_tag != 0xABCD:
+            raise ValueError(f"Wrong map header file: {maphead_path}")
+
+        offsets = np.frombuffer(maphead, dtype="<u4", count=(len(maphead) - 2) // 4, offset=2)
+        zeros = np.flatnonzero(offsets == 0)
+        self.offsets = offsets[:zeros[0]] if len(zeros) else offsets
+
+        with open(gamemaps_path, "rb") as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        data = np.frombuffer(self.mm, dtype=np.uint8)
+
+        # Gather every level header at once
+        rows = self.offsets[:, None].astype(np.intp) + np.arange(map_header_dtype.itemsize)
+        if rows.size and rows.max() >= len(data):
+            del data
+            self.mm.close()
+            raise ValueError(f"Level headers past the end of {gamemaps_path}")
+        self.headers = np.ascontiguousarray(data[rows]).view(map_header_dtype).ravel()
+        del data
+
+        self.levels = [
+            GameMapsLevel(
+                archive=self,
+                index=i,
+                name=h["name"].decode("ascii", errors="ignore").split("\x00", 1)[0],
+                width=int(h["width"]),
+                height=int(h["height"]),
+            )
+            for i, h in enumerate(self.headers)
+        ]
+
+        self._plane_cached = lru_cache(maxsize=cache_size)(self._decode_plane)
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __getitem__(self, level):
+        return self.levels[level]
+
+    def __iter__(self):
+        return iter(self.levels)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._plane_cached.cache_clear()
+        close_map(self.mm)
+        self.mm = None
+
+    def plane_bytes(self, level, n):
+        header = self.headers[level]
+        offset = int(header["planestart"][n])
+        return memoryview(self.mm)[offset:offset + int(header["planelength"][n])]
+
+    def plane(self, level, n):
+        return self._plane_cached(level, n)
+
+    def _decode_plane(self, level, n):
+        header = self.headers[level]
+        with self.plane_bytes(level, n) as raw:
+            plane = File_MAP_Expand(raw, self.rlew_tag, (int(header["height"]), int(header["width"])))
+        # Cached planes are shared between callers
+        plane.flags.writeable = False
+        return plane
+
+
+def open_game_maps(maphead_path: Path, gamemaps_path: Path):
+    # GameMapsArchive, raising AssetError if the files are missing or malformed
+    try:
+        return GameMapsArchive(maphead_path, gamemaps_path)
+    except data_errors as e:
+        raise AssetError(f"Unable to open map files: {e}") from e
+
+
+def level_planes(archive: GameMapsArchive, level):
+    # (3, height, width) planes: tiles, things and the unused third plane
+    try:
+        return np.stack([archive.plane(level, n) for n in range(3)])
+    except data_errors as e:
+        raise AssetError(f"Unable to decode level {level} ({archive[level].name}): {e}") from e
+
+
+def iter_levels(maphead_path: Path, gamemaps_path: Path, select=None, pattern=None):
+    # Lazily decoded levels as (index, name, (3, height, width) planes), select is a slice of
+    # the levels and pattern a glob on their names. Levels that can't be decoded raise AssetError.
+    # The archive stays open until the generator is exhausted or closed.
+    with open_game_maps(maphead_path, gamemaps_path) as archive:
+        names = [level.name for level in archive]
+        for level in select_indices(names, select, pattern):
+            yield level, names[level], level_planes(archive, level)
+
+
+map_formats = ["json", "json-base64", "bin", "npy", "npz"]
+
+
+# json:        planes as lists of integers inside the JSON file
+# json-base64: planes as base64 encoded little-endian uint16 inside the JSON file
+# bin/npy/npz: planes stacked as (planes, height, width) little-endian uint16 in a
+#              separate file, the JSON file lists the plane names in "Planes"
+def map_level_outputs(stem: Path, map_format="json"):
+    outputs = [stem.with_name(f"{stem.name}.json")]
+    if map_format not in ("json", "json-base64"):
+        outputs.append(stem.with_name(f"{stem.name}.{map_format}"))
+    return outputs
+
+
+def write_map_level(stem: Path, map_root, planes, map_format="json", writer: OutputWriter = None):
+    writer = writer or OutputWriter()
+    map_root = dict(map_root)
+    stacked = np.stack(list(planes.values())).astype("<u2")
+
+    if map_format == "json":
+        for key, plane in planes.items():
+            map_root[key] = plane.ravel().tolist()
+    elif map_format == "json-base64":
+        map_root["Width"] = stacked.shape[2]
+        map_root["Height"] = stacked.shape[1]
+        for key, plane in zip(planes, stacked):
+            map_root[key] = base64.b64encode(plane.tobytes()).decode("ascii")
+    else:
+        map_root["Width"] = stacked.shape[2]
+        map_root["Height"] = stacked.shape[1]
+        map_root["Planes"] = list(planes)
+        data_path = stem.with_name(f"{stem.name}.{map_format}")
+        map_root["File"] = data_path.name
+        if map_format == "bin":
+            writer.write_bytes(data_path, stacked.tobytes())
+        elif map_format == "npy":
+            buf = io.BytesIO()
+            np.save(buf, stacked)
+            writer.write_bytes(data_path, buf.getvalue())
+        elif map_format == "npz":
+            buf = io.BytesIO()
+            np.savez(buf, **dict(zip(planes, stacked)))
+            writer.write_bytes(data_path, buf.getvalue())
         else:
-            count = src_words[i]
-            i += 1
-            val = src_words[i]
-            i += 1
-            out.extend([val] * count)
-    return out
+            raise ValueError(f"Unknown map format: {map_format}")
 
+    writer.write_text(stem.with_name(f"{stem.name}.json"), json.dumps(map_root))
 
-def File_MAP_Expand(raw_bytes, rlew_tag):
-    carmacked = File_CarmackExpand(raw_bytes)
-    # skip 2-byte length prefix before RLEW
-    return File_RLEWexpand(carmacked[1:], rlew_tag)
 
+def _extract_level(archive: GameMapsArchive, level, renderer, thumb_file: Path, stem: Path, map_root,
+                   map_format="json", writer: OutputWriter = None):
+    layer1, layer2, layer3 = level_planes(archive, level)
+
+    thumb = renderer.render([layer1, layer2, layer3])
+    writer.save_image(Image.fromarray(thumb, "RGB"), thumb_file)
+
+    write_map_level(stem, map_root, {"Tiles": layer1, "Things": layer2}, map_format, writer)
 
-def extract_maps(maphead_path: Path, gamemaps_path: Path):
+
+def extract_maps(maphead_path: Path, gamemaps_path: Path, color_scheme=None, thumb_scale=1,
+                 map_format="json", shard=None, output_root: Path = Path("."), writer: OutputWriter = None):
+    # shard (k, n) limits levels to part k of n, outputs are written below output_root
+    writer = writer or OutputWriter()
     print("FileIO: Map Files")
 
-    spear = True if maphead_path.suffix.lower() == ".sod" else False
+    spear = is_spear_file(maphead_path)
     palette = SodPal if spear else WolfPal
     ceiling_colors = sod_ceilings_colors if spear else wl6_ceilings_colors
 
     # Create output directories
-    thumb_path = Path("maps/thumbs")
+    thumb_path = Path(output_root) / "maps/thumbs"
     thumb_path.mkdir(parents=True, exist_ok=True)
 
-    json_path = Path("maps/json")
+    json_path = Path(output_root) / "maps/json"
     json_path.mkdir(parents=True, exist_ok=True)
 
-    map_offsets = []
-    with open(maphead_path, "rb") as mh:
-        sig = struct.unpack("<H", mh.read(2))[0]
-
-        if sig != 0xABCD:
-            print(f"FileIO: Wrong map header file: {maphead_path}")
-            return 0
-
-        # maybe just read till EOF instead?
-        for _ in range((maphead_path.stat().st_size - 2) // 4):
-            map_offset = struct.unpack("<L", mh.read(4))[0]
-            if map_offset == 0:
-                break
-            map_offsets.append(map_offset)
+    archive = open_game_maps(maphead_path, gamemaps_path)
 
-    print(f"-> Total Levels: {len(map_offsets)}")
+    print(f"-> Total Levels: {len(archive)}")
 
-    idx_formant = f"{{:0{int(math.log10(len(map_offsets) - 1)) + 1}d}}"
+    idx_formant = f"{{:0{int(math.log10(len(archive) - 1)) + 1}d}}"
 
-    with open(gamemaps_path, "rb") as gm:
-        for level, map_offset in enumerate(map_offsets):
-            gm.seek(map_offset)
-            l1_offset = struct.unpack("<L", gm.read(4))[0]
-            l2_offset = struct.unpack("<L", gm.read(4))[0]
-            l3_offset = struct.unpack("<L", gm.read(4))[0]
+    color_scheme = color_scheme or default_map_color_scheme
+    renderer = MapRenderer(color_scheme, thumb_scale)
 
-            l1_len = struct.unpack("<H", gm.read(2))[0]
-            l2_len = struct.unpack("<H", gm.read(2))[0]
-            l3_len = struct.unpack("<H", gm.read(2))[0]
-
-            width = struct.unpack("<H", gm.read(2))[0]
-            height = struct.unpack("<H", gm.read(2))[0]
-
-            name = gm.read(16).decode('ascii', errors='ignore').split('\x00', 1)[0]
-            sig = gm.read(4).decode('ascii', errors='ignore') # !ID!
-
-            assert width == 64 and height == 64, f"Unexpected map size: {width}x{height}"
-
-            def read_and_expand(offset, length):
-                gm.seek(offset)
-                data = gm.read(length)
-                return File_MAP_Expand(data, 0xABCD)
-
-            layer1 = read_and_expand(l1_offset, l1_len)
-            layer2 = read_and_expand(l2_offset, l2_len)
-            layer3 = read_and_expand(l3_offset, l3_len)
-
-            base = np.array([tile_to_color(t) for t in layer1], dtype=np.uint8).reshape((64, 64, 3))
-
-            if layer2:
-                overlay = np.array([
-                    (0, 255, 0) if t == 19 else (0, 0, 0) for t in layer2
-                ], dtype=np.uint8).reshape((64, 64, 3))
-                combined = np.clip(base + overlay, 0, 255)
-            else:
-                combined = base
-
-            Image.fromarray(combined, "RGB").save(thumb_path / f"{idx_formant.format(level)}_{name}.png")
+    skipped = 0
+    with archive:
+        for level in shard_range(len(archive), shard):
+            map_level = archive[level]
+            name = map_level.name
+            assert map_level.width == 64 and map_level.height == 64, \
+                f"Unexpected map size: {map_level.width}x{map_level.height}"
 
             map_root = {
                 "Name": name,
-                "CeilingColor": palette[ceiling_colors[level]],
-                "FloorColor": palette[floor_color],
-                "Tiles": layer1,
-                "Things": layer2,
+                "CeilingColor": palette[ceiling_colors[level]].tolist(),
+                "FloorColor": palette[floor_color].tolist(),
             }
 
-            with open(json_path / f"{idx_formant.format(level)}_{name}.json", "w") as f:
-                json.dump(map_root, f)
+            thumb_file = thumb_path / f"{idx_formant.format(level)}_{name}.png"
+            stem = json_path / f"{idx_formant.format(level)}_{name}"
+
+            # Views into the archive, released before it closes
+            planes = [archive.plane_bytes(level, n) for n in range(3)]
+            unchanged = writer.unchanged([thumb_file] + map_level_outputs(stem, map_format), *planes,
+                                         archive.rlew_tag, map_root, color_scheme, thumb_scale, map_format)
+            for plane in planes:
+                plane.release()
+            if unchanged:
+                skipped += 1
+                continue
+
+            _extract_level(archive, level, renderer, thumb_file, stem, map_root, map_format, writer)
+
+    if skipped:
+        print(f"-> Unchanged Levels: {skipped}")
 
     return 1
 
 
-def tile_to_color(tile):
-    if tile == 0:
-        return 255, 255, 255
-    elif 1 <= tile <= 63:
-        return 64, 64, 64
-    elif 90 <= tile <= 101:
-        return 0, 128, 255
-    elif 106 <= tile <= 111:
-        return 255, 0, 0
-    else:
-        return 128, 128, 128
+# Per plane (tiles, things, third plane): default color and (first, last, color) ranges.
+# Colors of all planes are added up per tile, saturating at 255.
+default_map_color_scheme = [
+    ((128, 128, 128), [
+        (0, 0, (255, 255, 255)),
+        (1, 63, (64, 64, 64)),
+        (90, 101, (0, 128, 255)),
+        (106, 111, (255, 0, 0)),
+    ]),
+    ((0, 0, 0), [
+        (19, 19, (0, 255, 0)),
+    ]),
+    ((0, 0, 0), []),
+]
+
+
+def build_plane_lut(default, ranges):
+    lut = np.empty((0x10000, 3), dtype=np.uint16)
+    lut[:] = default
+    for first, last, color in ranges:
+        lut[first:last + 1] = color
+    return lut
+
+
+class MapRenderer:
+    def __init__(self, color_scheme=default_map_color_scheme, scale=1):
+        self.luts = np.stack([build_plane_lut(default, ranges) for default, ranges in color_scheme])
+        self.scale = scale
+
+    def render(self, planes):
+        planes = np.stack(planes[:len(self.luts)])
+        # One gather for all planes: (planes, 64, 64) -> (planes, 64, 64, 3)
+        colors = self.luts[np.arange(len(planes))[:, None, None], planes]
+        img = np.minimum(colors.sum(axis=0), 255).astype(np.uint8)
+        if self.scale > 1:
+            img = img.repeat(self.scale, axis=0).repeat(self.scale, axis=1)
+        return img
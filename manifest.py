@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+
+# Bump when any extractor writes different output for the same input
+extractor_version = 1
+
+manifest_name = "extract-manifest.json"
+
+
+def source_hash(*sources):
+    # Hash of everything an output is made from: bytes-like sources are hashed as they are,
+    # arrays by their contents and anything else (options, names, headers) by its repr
+    h = hashlib.blake2b(digest_size=16)
+    h.update(struct.pack('<L', extractor_version))
+    for source in sources:
+        if isinstance(source, np.ndarray):
+            source = source.tobytes()
+        elif not isinstance(source, (bytes, bytearray, memoryview)):
+            source = repr(source).encode()
+        data = memoryview(source).cast('B')
+        h.update(struct.pack('<Q', len(data)))
+        h.update(data)
+    return h.hexdigest()
+
+
+class ExtractManifest:
+    # Source hash of every output below the manifest's directory, from the previous run (previous)
+    # and as checked in this one (entries). Outputs are keyed by their path relative to that directory.
+    def __init__(self, path: Path = Path(manifest_name), force=False):
+        self.path = Path(path)
+        self.root = self.path.parent
+        self.force = force
+        self.previous = {}
+        self.entries = {}
+
+        if self.path.is_file():
+            try:
+                data = json.loads(self.path.read_text())
+            except ValueError:
+                print(f"FileIO: Ignoring unreadable manifest: {self.path}")
+                data = {}
+            # Outputs of another extractor version are all stale
+            if data.get("version") == extractor_version:
+                self.previous = data.get("outputs", {})
+
+    def unchanged(self, paths, digest):
+        # Records digest for the outputs, True if they all exist and were made from the same sources
+        keys = [Path(os.path.relpath(path, self.root)).as_posix() for path in paths]
+        for key in keys:
+            self.entries[key] = digest
+        if self.force:
+            return False
+        return all(self.previous.get(key) == digest and (self.root / key).is_file() for key in keys)
+
+    def save(self, entries=None):
+        # Outputs not checked in this run keep their previous entry
+        outputs = dict(self.previous)
+        outputs.update(self.entries if entries is None else entries)
+        self.path.write_text(json.dumps({
+            "version": extractor_version,
+            "outputs": dict(sorted(outputs.items())),
+        }, indent=1))
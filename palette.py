@@ -1,3 +1,9 @@
+import warnings
+
+import numpy as np
+from PIL import Image
+
+
 def RGB(r, g, b):
     return [
         r * 255 // 63,
@@ -5,114 +11,190 @@ def RGB(r, g, b):
         b * 255 // 63,
     ]
 
+
+def vga_to_rgb(pal):
+    # 6-bit VGA DAC values to 8-bit RGB, same rounding as RGB(). Unlike RGB(), values above 63
+    # (seen in some mod palettes) are masked to their low 6 bits, as the VGA DAC itself does,
+    # instead of overflowing a byte. A warning is raised when that happens.
+    pal = np.asarray(pal, dtype=np.uint16).reshape((-1, 3))
+    if (pal > 0x3F).any():
+        warnings.warn(f"Palette has {int((pal > 0x3F).sum())} values above 63, masked to 6 bits", stacklevel=2)
+    return ((pal & 0x3F) * 255 // 63).astype(np.uint8)
+
+
 # wolfpal.inc
-WolfPal = [
-    RGB(  0,  0,  0),RGB(  0,  0, 42),RGB(  0, 42,  0),RGB(  0, 42, 42),RGB( 42,  0,  0),
-    RGB( 42,  0, 42),RGB( 42, 21,  0),RGB( 42, 42, 42),RGB( 21, 21, 21),RGB( 21, 21, 63),
-    RGB( 21, 63, 21),RGB( 21, 63, 63),RGB( 63, 21, 21),RGB( 63, 21, 63),RGB( 63, 63, 21),
-    RGB( 63, 63, 63),RGB( 59, 59, 59),RGB( 55, 55, 55),RGB( 52, 52, 52),RGB( 48, 48, 48),
-    RGB( 45, 45, 45),RGB( 42, 42, 42),RGB( 38, 38, 38),RGB( 35, 35, 35),RGB( 31, 31, 31),
-    RGB( 28, 28, 28),RGB( 25, 25, 25),RGB( 21, 21, 21),RGB( 18, 18, 18),RGB( 14, 14, 14),
-    RGB( 11, 11, 11),RGB(  8,  8,  8),RGB( 63,  0,  0),RGB( 59,  0,  0),RGB( 56,  0,  0),
-    RGB( 53,  0,  0),RGB( 50,  0,  0),RGB( 47,  0,  0),RGB( 44,  0,  0),RGB( 41,  0,  0),
-    RGB( 38,  0,  0),RGB( 34,  0,  0),RGB( 31,  0,  0),RGB( 28,  0,  0),RGB( 25,  0,  0),
-    RGB( 22,  0,  0),RGB( 19,  0,  0),RGB( 16,  0,  0),RGB( 63, 54, 54),RGB( 63, 46, 46),
-    RGB( 63, 39, 39),RGB( 63, 31, 31),RGB( 63, 23, 23),RGB( 63, 16, 16),RGB( 63,  8,  8),
-    RGB( 63,  0,  0),RGB( 63, 42, 23),RGB( 63, 38, 16),RGB( 63, 34,  8),RGB( 63, 30,  0),
-    RGB( 57, 27,  0),RGB( 51, 24,  0),RGB( 45, 21,  0),RGB( 39, 19,  0),RGB( 63, 63, 54),
-    RGB( 63, 63, 46),RGB( 63, 63, 39),RGB( 63, 63, 31),RGB( 63, 62, 23),RGB( 63, 61, 16),
-    RGB( 63, 61,  8),RGB( 63, 61,  0),RGB( 57, 54,  0),RGB( 51, 49,  0),RGB( 45, 43,  0),
-    RGB( 39, 39,  0),RGB( 33, 33,  0),RGB( 28, 27,  0),RGB( 22, 21,  0),RGB( 16, 16,  0),
-    RGB( 52, 63, 23),RGB( 49, 63, 16),RGB( 45, 63,  8),RGB( 40, 63,  0),RGB( 36, 57,  0),
-    RGB( 32, 51,  0),RGB( 29, 45,  0),RGB( 24, 39,  0),RGB( 54, 63, 54),RGB( 47, 63, 46),
-    RGB( 39, 63, 39),RGB( 32, 63, 31),RGB( 24, 63, 23),RGB( 16, 63, 16),RGB(  8, 63,  8),
-    RGB(  0, 63,  0),RGB(  0, 63,  0),RGB(  0, 59,  0),RGB(  0, 56,  0),RGB(  0, 53,  0),
-    RGB(  1, 50,  0),RGB(  1, 47,  0),RGB(  1, 44,  0),RGB(  1, 41,  0),RGB(  1, 38,  0),
-    RGB(  1, 34,  0),RGB(  1, 31,  0),RGB(  1, 28,  0),RGB(  1, 25,  0),RGB(  1, 22,  0),
-    RGB(  1, 19,  0),RGB(  1, 16,  0),RGB( 54, 63, 63),RGB( 46, 63, 63),RGB( 39, 63, 63),
-    RGB( 31, 63, 62),RGB( 23, 63, 63),RGB( 16, 63, 63),RGB(  8, 63, 63),RGB(  0, 63, 63),
-    RGB(  0, 57, 57),RGB(  0, 51, 51),RGB(  0, 45, 45),RGB(  0, 39, 39),RGB(  0, 33, 33),
-    RGB(  0, 28, 28),RGB(  0, 22, 22),RGB(  0, 16, 16),RGB( 23, 47, 63),RGB( 16, 44, 63),
-    RGB(  8, 42, 63),RGB(  0, 39, 63),RGB(  0, 35, 57),RGB(  0, 31, 51),RGB(  0, 27, 45),
-    RGB(  0, 23, 39),RGB( 54, 54, 63),RGB( 46, 47, 63),RGB( 39, 39, 63),RGB( 31, 32, 63),
-    RGB( 23, 24, 63),RGB( 16, 16, 63),RGB(  8,  9, 63),RGB(  0,  1, 63),RGB(  0,  0, 63),
-    RGB(  0,  0, 59),RGB(  0,  0, 56),RGB(  0,  0, 53),RGB(  0,  0, 50),RGB(  0,  0, 47),
-    RGB(  0,  0, 44),RGB(  0,  0, 41),RGB(  0,  0, 38),RGB(  0,  0, 34),RGB(  0,  0, 31),
-    RGB(  0,  0, 28),RGB(  0,  0, 25),RGB(  0,  0, 22),RGB(  0,  0, 19),RGB(  0,  0, 16),
-    RGB( 10, 10, 10),RGB( 63, 56, 13),RGB( 63, 53,  9),RGB( 63, 51,  6),RGB( 63, 48,  2),
-    RGB( 63, 45,  0),RGB( 45,  8, 63),RGB( 42,  0, 63),RGB( 38,  0, 57),RGB( 32,  0, 51),
-    RGB( 29,  0, 45),RGB( 24,  0, 39),RGB( 20,  0, 33),RGB( 17,  0, 28),RGB( 13,  0, 22),
-    RGB( 10,  0, 16),RGB( 63, 54, 63),RGB( 63, 46, 63),RGB( 63, 39, 63),RGB( 63, 31, 63),
-    RGB( 63, 23, 63),RGB( 63, 16, 63),RGB( 63,  8, 63),RGB( 63,  0, 63),RGB( 56,  0, 57),
-    RGB( 50,  0, 51),RGB( 45,  0, 45),RGB( 39,  0, 39),RGB( 33,  0, 33),RGB( 27,  0, 28),
-    RGB( 22,  0, 22),RGB( 16,  0, 16),RGB( 63, 58, 55),RGB( 63, 56, 52),RGB( 63, 54, 49),
-    RGB( 63, 53, 47),RGB( 63, 51, 44),RGB( 63, 49, 41),RGB( 63, 47, 39),RGB( 63, 46, 36),
-    RGB( 63, 44, 32),RGB( 63, 41, 28),RGB( 63, 39, 24),RGB( 60, 37, 23),RGB( 58, 35, 22),
-    RGB( 55, 34, 21),RGB( 52, 32, 20),RGB( 50, 31, 19),RGB( 47, 30, 18),RGB( 45, 28, 17),
-    RGB( 42, 26, 16),RGB( 40, 25, 15),RGB( 39, 24, 14),RGB( 36, 23, 13),RGB( 34, 22, 12),
-    RGB( 32, 20, 11),RGB( 29, 19, 10),RGB( 27, 18,  9),RGB( 23, 16,  8),RGB( 21, 15,  7),
-    RGB( 18, 14,  6),RGB( 16, 12,  6),RGB( 14, 11,  5),RGB( 10,  8,  3),RGB( 24,  0, 25),
-    RGB(  0, 25, 25),RGB(  0, 24, 24),RGB(  0,  0,  7),RGB(  0,  0, 11),RGB( 12,  9,  4),
-    RGB( 18,  0, 18),RGB( 20,  0, 20),RGB(  0,  0, 13),RGB(  7,  7,  7),RGB( 19, 19, 19),
-    RGB( 23, 23, 23),RGB( 16, 16, 16),RGB( 12, 12, 12),RGB( 13, 13, 13),RGB( 54, 61, 61),
-    RGB( 46, 58, 58),RGB( 39, 55, 55),RGB( 29, 50, 50),RGB( 18, 48, 48),RGB(  8, 45, 45),
-    RGB(  8, 44, 44),RGB(  0, 41, 41),RGB(  0, 38, 38),RGB(  0, 35, 35),RGB(  0, 33, 33),
-    RGB(  0, 31, 31),RGB(  0, 30, 30),RGB(  0, 29, 29),RGB(  0, 28, 28),RGB(  0, 27, 27),
-    RGB( 38,  0, 34)
-]
+WolfPal = vga_to_rgb([
+    (  0,  0,  0),(  0,  0, 42),(  0, 42,  0),(  0, 42, 42),( 42,  0,  0),
+    ( 42,  0, 42),( 42, 21,  0),( 42, 42, 42),( 21, 21, 21),( 21, 21, 63),
+    ( 21, 63, 21),( 21, 63, 63),( 63, 21, 21),( 63, 21, 63),( 63, 63, 21),
+    ( 63, 63, 63),( 59, 59, 59),( 55, 55, 55),( 52, 52, 52),( 48, 48, 48),
+    ( 45, 45, 45),( 42, 42, 42),( 38, 38, 38),( 35, 35, 35),( 31, 31, 31),
+    ( 28, 28, 28),( 25, 25, 25),( 21, 21, 21),( 18, 18, 18),( 14, 14, 14),
+    ( 11, 11, 11),(  8,  8,  8),( 63,  0,  0),( 59,  0,  0),( 56,  0,  0),
+    ( 53,  0,  0),( 50,  0,  0),( 47,  0,  0),( 44,  0,  0),( 41,  0,  0),
+    ( 38,  0,  0),( 34,  0,  0),( 31,  0,  0),( 28,  0,  0),( 25,  0,  0),
+    ( 22,  0,  0),( 19,  0,  0),( 16,  0,  0),( 63, 54, 54),( 63, 46, 46),
+    ( 63, 39, 39),( 63, 31, 31),( 63, 23, 23),( 63, 16, 16),( 63,  8,  8),
+    ( 63,  0,  0),( 63, 42, 23),( 63, 38, 16),( 63, 34,  8),( 63, 30,  0),
+    ( 57, 27,  0),( 51, 24,  0),( 45, 21,  0),( 39, 19,  0),( 63, 63, 54),
+    ( 63, 63, 46),( 63, 63, 39),( 63, 63, 31),( 63, 62, 23),( 63, 61, 16),
+    ( 63, 61,  8),( 63, 61,  0),( 57, 54,  0),( 51, 49,  0),( 45, 43,  0),
+    ( 39, 39,  0),( 33, 33,  0),( 28, 27,  0),( 22, 21,  0),( 16, 16,  0),
+    ( 52, 63, 23),( 49, 63, 16),( 45, 63,  8),( 40, 63,  0),( 36, 57,  0),
+    ( 32, 51,  0),( 29, 45,  0),( 24, 39,  0),( 54, 63, 54),( 47, 63, 46),
+    ( 39, 63, 39),( 32, 63, 31),( 24, 63, 23),( 16, 63, 16),(  8, 63,  8),
+    (  0, 63,  0),(  0, 63,  0),(  0, 59,  0),(  0, 56,  0),(  0, 53,  0),
+    (  1, 50,  0),(  1, 47,  0),(  1, 44,  0),(  1, 41,  0),(  1, 38,  0),
+    (  1, 34,  0),(  1, 31,  0),(  1, 28,  0),(  1, 25,  0),(  1, 22,  0),
+    (  1, 19,  0),(  1, 16,  0),( 54, 63, 63),( 46, 63, 63),( 39, 63, 63),
+    ( 31, 63, 62),( 23, 63, 63),( 16, 63, 63),(  8, 63, 63),(  0, 63, 63),
+    (  0, 57, 57),(  0, 51, 51),(  0, 45, 45),(  0, 39, 39),(  0, 33, 33),
+    (  0, 28, 28),(  0, 22, 22),(  0, 16, 16),( 23, 47, 63),( 16, 44, 63),
+    (  8, 42, 63),(  0, 39, 63),(  0, 35, 57),(  0, 31, 51),(  0, 27, 45),
+    (  0, 23, 39),( 54, 54, 63),( 46, 47, 63),( 39, 39, 63),( 31, 32, 63),
+    ( 23, 24, 63),( 16, 16, 63),(  8,  9, 63),(  0,  1, 63),(  0,  0, 63),
+    (  0,  0, 59),(  0,  0, 56),(  0,  0, 53),(  0,  0, 50),(  0,  0, 47),
+    (  0,  0, 44),(  0,  0, 41),(  0,  0, 38),(  0,  0, 34),(  0,  0, 31),
+    (  0,  0, 28),(  0,  0, 25),(  0,  0, 22),(  0,  0, 19),(  0,  0, 16),
+    ( 10, 10, 10),( 63, 56, 13),( 63, 53,  9),( 63, 51,  6),( 63, 48,  2),
+    ( 63, 45,  0),( 45,  8, 63),( 42,  0, 63),( 38,  0, 57),( 32,  0, 51),
+    ( 29,  0, 45),( 24,  0, 39),( 20,  0, 33),( 17,  0, 28),( 13,  0, 22),
+    ( 10,  0, 16),( 63, 54, 63),( 63, 46, 63),( 63, 39, 63),( 63, 31, 63),
+    ( 63, 23, 63),( 63, 16, 63),( 63,  8, 63),( 63,  0, 63),( 56,  0, 57),
+    ( 50,  0, 51),( 45,  0, 45),( 39,  0, 39),( 33,  0, 33),( 27,  0, 28),
+    ( 22,  0, 22),( 16,  0, 16),( 63, 58, 55),( 63, 56, 52),( 63, 54, 49),
+    ( 63, 53, 47),( 63, 51, 44),( 63, 49, 41),( 63, 47, 39),( 63, 46, 36),
+    ( 63, 44, 32),( 63, 41, 28),( 63, 39, 24),( 60, 37, 23),( 58, 35, 22),
+    ( 55, 34, 21),( 52, 32, 20),( 50, 31, 19),( 47, 30, 18),( 45, 28, 17),
+    ( 42, 26, 16),( 40, 25, 15),( 39, 24, 14),( 36, 23, 13),( 34, 22, 12),
+    ( 32, 20, 11),( 29, 19, 10),( 27, 18,  9),( 23, 16,  8),( 21, 15,  7),
+    ( 18, 14,  6),( 16, 12,  6),( 14, 11,  5),( 10,  8,  3),( 24,  0, 25),
+    (  0, 25, 25),(  0, 24, 24),(  0,  0,  7),(  0,  0, 11),( 12,  9,  4),
+    ( 18,  0, 18),( 20,  0, 20),(  0,  0, 13),(  7,  7,  7),( 19, 19, 19),
+    ( 23, 23, 23),( 16, 16, 16),( 12, 12, 12),( 13, 13, 13),( 54, 61, 61),
+    ( 46, 58, 58),( 39, 55, 55),( 29, 50, 50),( 18, 48, 48),(  8, 45, 45),
+    (  8, 44, 44),(  0, 41, 41),(  0, 38, 38),(  0, 35, 35),(  0, 33, 33),
+    (  0, 31, 31),(  0, 30, 30),(  0, 29, 29),(  0, 28, 28),(  0, 27, 27),
+    ( 38,  0, 34)
+])
 
 # sodpal.inc
-SodPal = [
-    RGB(  0,  0,  0),RGB(  0,  0, 42),RGB(  0, 42,  0),RGB(  0, 42, 42),RGB( 42,  0,  0),
-    RGB( 42,  0, 42),RGB( 42, 21,  0),RGB( 42, 42, 42),RGB( 21, 21, 21),RGB( 21, 21, 63),
-    RGB( 21, 63, 21),RGB( 21, 63, 63),RGB( 63, 21, 21),RGB( 63, 21, 63),RGB( 63, 63, 21),
-    RGB( 63, 63, 63),RGB( 59, 59, 59),RGB( 55, 55, 55),RGB( 52, 52, 52),RGB( 48, 48, 48),
-    RGB( 45, 45, 45),RGB( 42, 42, 42),RGB( 38, 38, 38),RGB( 35, 35, 35),RGB( 31, 31, 31),
-    RGB( 28, 28, 28),RGB( 25, 25, 25),RGB( 21, 21, 21),RGB( 18, 18, 18),RGB( 14, 14, 14),
-    RGB( 11, 11, 11),RGB(  8,  8,  8),RGB( 63,  0,  0),RGB( 59,  0,  0),RGB( 56,  0,  0),
-    RGB( 53,  0,  0),RGB( 50,  0,  0),RGB( 47,  0,  0),RGB( 44,  0,  0),RGB( 41,  0,  0),
-    RGB( 38,  0,  0),RGB( 34,  0,  0),RGB( 31,  0,  0),RGB( 28,  0,  0),RGB( 25,  0,  0),
-    RGB( 22,  0,  0),RGB( 19,  0,  0),RGB( 16,  0,  0),RGB( 63, 54, 54),RGB( 63, 46, 46),
-    RGB( 63, 39, 39),RGB( 63, 31, 31),RGB( 63, 23, 23),RGB( 63, 16, 16),RGB( 63,  8,  8),
-    RGB( 63,  0,  0),RGB( 63, 42, 23),RGB( 63, 38, 16),RGB( 63, 34,  8),RGB( 63, 30,  0),
-    RGB( 57, 27,  0),RGB( 51, 24,  0),RGB( 45, 21,  0),RGB( 39, 19,  0),RGB( 63, 63, 54),
-    RGB( 63, 63, 46),RGB( 63, 63, 39),RGB( 63, 63, 31),RGB( 63, 62, 23),RGB( 63, 61, 16),
-    RGB( 63, 61,  8),RGB( 63, 61,  0),RGB( 57, 54,  0),RGB( 51, 49,  0),RGB( 45, 43,  0),
-    RGB( 39, 39,  0),RGB( 33, 33,  0),RGB( 28, 27,  0),RGB( 22, 21,  0),RGB( 16, 16,  0),
-    RGB( 52, 63, 23),RGB( 49, 63, 16),RGB( 45, 63,  8),RGB( 40, 63,  0),RGB( 36, 57,  0),
-    RGB( 32, 51,  0),RGB( 29, 45,  0),RGB( 24, 39,  0),RGB( 54, 63, 54),RGB( 47, 63, 46),
-    RGB( 39, 63, 39),RGB( 32, 63, 31),RGB( 24, 63, 23),RGB( 16, 63, 16),RGB(  8, 63,  8),
-    RGB(  0, 63,  0),RGB(  0, 63,  0),RGB(  0, 59,  0),RGB(  0, 56,  0),RGB(  0, 53,  0),
-    RGB(  1, 50,  0),RGB(  1, 47,  0),RGB(  1, 44,  0),RGB(  1, 41,  0),RGB(  1, 38,  0),
-    RGB(  1, 34,  0),RGB(  1, 31,  0),RGB(  1, 28,  0),RGB(  1, 25,  0),RGB(  1, 22,  0),
-    RGB(  1, 19,  0),RGB(  1, 16,  0),RGB( 54, 63, 63),RGB( 46, 63, 63),RGB( 39, 63, 63),
-    RGB( 31, 63, 62),RGB( 23, 63, 63),RGB( 16, 63, 63),RGB(  8, 63, 63),RGB(  0, 63, 63),
-    RGB(  0, 57, 57),RGB(  0, 51, 51),RGB(  0, 45, 45),RGB(  0, 39, 39),RGB(  0, 33, 33),
-    RGB(  0, 28, 28),RGB(  0, 22, 22),RGB(  0, 16, 16),RGB( 23, 47, 63),RGB( 16, 44, 63),
-    RGB(  8, 42, 63),RGB(  0, 39, 63),RGB(  0, 35, 57),RGB(  0, 31, 51),RGB(  0, 27, 45),
-    RGB(  0, 23, 39),RGB( 54, 54, 63),RGB( 46, 47, 63),RGB( 39, 39, 63),RGB( 31, 32, 63),
-    RGB( 23, 24, 63),RGB( 16, 16, 63),RGB(  8,  9, 63),RGB(  0,  1, 63),RGB(  0,  0, 63),
-    RGB(  0,  0, 59),RGB(  0,  0, 56),RGB(  0,  0, 53),RGB(  0,  0, 50),RGB(  0,  0, 47),
-    RGB(  0,  0, 44),RGB(  0,  0, 41),RGB(  0,  0, 38),RGB(  0,  0, 34),RGB(  0,  0, 31),
-    RGB(  0,  0, 28),RGB(  0,  0, 25),RGB(  0,  0, 22),RGB(  0,  0, 19),RGB(  0,  0, 16),
-    RGB( 10, 10, 10),RGB( 63, 56, 13),RGB( 63, 53,  9),RGB( 63, 51,  6),RGB( 63, 48,  2),
-    RGB( 63, 45,  0),RGB(  0, 14,  0),RGB(  0, 10,  0),RGB( 38,  0, 57),RGB( 32,  0, 51),
-    RGB( 29,  0, 45),RGB( 24,  0, 39),RGB( 20,  0, 33),RGB( 17,  0, 28),RGB( 13,  0, 22),
-    RGB( 10,  0, 16),RGB( 63, 54, 63),RGB( 63, 46, 63),RGB( 63, 39, 63),RGB( 63, 31, 63),
-    RGB( 63, 23, 63),RGB( 63, 16, 63),RGB( 63,  8, 63),RGB( 63,  0, 63),RGB( 56,  0, 57),
-    RGB( 50,  0, 51),RGB( 45,  0, 45),RGB( 39,  0, 39),RGB( 33,  0, 33),RGB( 27,  0, 28),
-    RGB( 22,  0, 22),RGB( 16,  0, 16),RGB( 63, 58, 55),RGB( 63, 56, 52),RGB( 63, 54, 49),
-    RGB( 63, 53, 47),RGB( 63, 51, 44),RGB( 63, 49, 41),RGB( 63, 47, 39),RGB( 63, 46, 36),
-    RGB( 63, 44, 32),RGB( 63, 41, 28),RGB( 63, 39, 24),RGB( 60, 37, 23),RGB( 58, 35, 22),
-    RGB( 55, 34, 21),RGB( 52, 32, 20),RGB( 50, 31, 19),RGB( 47, 30, 18),RGB( 45, 28, 17),
-    RGB( 42, 26, 16),RGB( 40, 25, 15),RGB( 39, 24, 14),RGB( 36, 23, 13),RGB( 34, 22, 12),
-    RGB( 32, 20, 11),RGB( 29, 19, 10),RGB( 27, 18,  9),RGB( 23, 16,  8),RGB( 21, 15,  7),
-    RGB( 18, 14,  6),RGB( 16, 12,  6),RGB( 14, 11,  5),RGB( 10,  8,  3),RGB( 24,  0, 25),
-    RGB(  0, 25, 25),RGB(  0, 24, 24),RGB(  0,  0,  7),RGB(  0,  0, 11),RGB( 12,  9,  4),
-    RGB( 18,  0, 18),RGB( 20,  0, 20),RGB(  0,  0, 13),RGB(  7,  7,  7),RGB( 19, 19, 19),
-    RGB( 23, 23, 23),RGB( 16, 16, 16),RGB( 12, 12, 12),RGB( 13, 13, 13),RGB( 54, 61, 61),
-    RGB( 46, 58, 58),RGB( 39, 55, 55),RGB( 29, 50, 50),RGB( 18, 48, 48),RGB(  8, 45, 45),
-    RGB(  8, 44, 44),RGB(  0, 41, 41),RGB(  0, 38, 38),RGB(  0, 35, 35),RGB(  0, 33, 33),
-    RGB(  0, 31, 31),RGB(  0, 30, 30),RGB(  0, 29, 29),RGB(  0, 28, 28),RGB(  0, 27, 27),
-    RGB( 38,  0, 34)
-]
+SodPal = vga_to_rgb([
+    (  0,  0,  0),(  0,  0, 42),(  0, 42,  0),(  0, 42, 42),( 42,  0,  0),
+    ( 42,  0, 42),( 42, 21,  0),( 42, 42, 42),( 21, 21, 21),( 21, 21, 63),
+    ( 21, 63, 21),( 21, 63, 63),( 63, 21, 21),( 63, 21, 63),( 63, 63, 21),
+    ( 63, 63, 63),( 59, 59, 59),( 55, 55, 55),( 52, 52, 52),( 48, 48, 48),
+    ( 45, 45, 45),( 42, 42, 42),( 38, 38, 38),( 35, 35, 35),( 31, 31, 31),
+    ( 28, 28, 28),( 25, 25, 25),( 21, 21, 21),( 18, 18, 18),( 14, 14, 14),
+    ( 11, 11, 11),(  8,  8,  8),( 63,  0,  0),( 59,  0,  0),( 56,  0,  0),
+    ( 53,  0,  0),( 50,  0,  0),( 47,  0,  0),( 44,  0,  0),( 41,  0,  0),
+    ( 38,  0,  0),( 34,  0,  0),( 31,  0,  0),( 28,  0,  0),( 25,  0,  0),
+    ( 22,  0,  0),( 19,  0,  0),( 16,  0,  0),( 63, 54, 54),( 63, 46, 46),
+    ( 63, 39, 39),( 63, 31, 31),( 63, 23, 23),( 63, 16, 16),( 63,  8,  8),
+    ( 63,  0,  0),( 63, 42, 23),( 63, 38, 16),( 63, 34,  8),( 63, 30,  0),
+    ( 57, 27,  0),( 51, 24,  0),( 45, 21,  0),( 39, 19,  0),( 63, 63, 54),
+    ( 63, 63, 46),( 63, 63, 39),( 63, 63, 31),( 63, 62, 23),( 63, 61, 16),
+    ( 63, 61,  8),( 63, 61,  0),( 57, 54,  0),( 51, 49,  0),( 45, 43,  0),
+    ( 39, 39,  0),( 33, 33,  0),( 28, 27,  0),( 22, 21,  0),( 16, 16,  0),
+    ( 52, 63, 23),( 49, 63, 16),( 45, 63,  8),( 40, 63,  0),( 36, 57,  0),
+    ( 32, 51,  0),( 29, 45,  0),( 24, 39,  0),( 54, 63, 54),( 47, 63, 46),
+    ( 39, 63, 39),( 32, 63, 31),( 24, 63, 23),( 16, 63, 16),(  8, 63,  8),
+    (  0, 63,  0),(  0, 63,  0),(  0, 59,  0),(  0, 56,  0),(  0, 53,  0),
+    (  1, 50,  0),(  1, 47,  0),(  1, 44,  0),(  1, 41,  0),(  1, 38,  0),
+    (  1, 34,  0),(  1, 31,  0),(  1, 28,  0),(  1, 25,  0),(  1, 22,  0),
+    (  1, 19,  0),(  1, 16,  0),( 54, 63, 63),( 46, 63, 63),( 39, 63, 63),
+    ( 31, 63, 62),( 23, 63, 63),( 16, 63, 63),(  8, 63, 63),(  0, 63, 63),
+    (  0, 57, 57),(  0, 51, 51),(  0, 45, 45),(  0, 39, 39),(  0, 33, 33),
+    (  0, 28, 28),(  0, 22, 22),(  0, 16, 16),( 23, 47, 63),( 16, 44, 63),
+    (  8, 42, 63),(  0, 39, 63),(  0, 35, 57),(  0, 31, 51),(  0, 27, 45),
+    (  0, 23, 39),( 54, 54, 63),( 46, 47, 63),( 39, 39, 63),( 31, 32, 63),
+    ( 23, 24, 63),( 16, 16, 63),(  8,  9, 63),(  0,  1, 63),(  0,  0, 63),
+    (  0,  0, 59),(  0,  0, 56),(  0,  0, 53),(  0,  0, 50),(  0,  0, 47),
+    (  0,  0, 44),(  0,  0, 41),(  0,  0, 38),(  0,  0, 34),(  0,  0, 31),
+    (  0,  0, 28),(  0,  0, 25),(  0,  0, 22),(  0,  0, 19),(  0,  0, 16),
+    ( 10, 10, 10),( 63, 56, 13),( 63, 53,  9),( 63, 51,  6),( 63, 48,  2),
+    ( 63, 45,  0),(  0, 14,  0),(  0, 10,  0),( 38,  0, 57),( 32,  0, 51),
+    ( 29,  0, 45),( 24,  0, 39),( 20,  0, 33),( 17,  0, 28),( 13,  0, 22),
+    ( 10,  0, 16),( 63, 54, 63),( 63, 46, 63),( 63, 39, 63),( 63, 31, 63),
+    ( 63, 23, 63),( 63, 16, 63),( 63,  8, 63),( 63,  0, 63),( 56,  0, 57),
+    ( 50,  0, 51),( 45,  0, 45),( 39,  0, 39),( 33,  0, 33),( 27,  0, 28),
+    ( 22,  0, 22),( 16,  0, 16),( 63, 58, 55),( 63, 56, 52),( 63, 54, 49),
+    ( 63, 53, 47),( 63, 51, 44),( 63, 49, 41),( 63, 47, 39),( 63, 46, 36),
+    ( 63, 44, 32),( 63, 41, 28),( 63, 39, 24),( 60, 37, 23),( 58, 35, 22),
+    ( 55, 34, 21),( 52, 32, 20),( 50, 31, 19),( 47, 30, 18),( 45, 28, 17),
+    ( 42, 26, 16),( 40, 25, 15),( 39, 24, 14),( 36, 23, 13),( 34, 22, 12),
+    ( 32, 20, 11),( 29, 19, 10),( 27, 18,  9),( 23, 16,  8),( 21, 15,  7),
+    ( 18, 14,  6),( 16, 12,  6),( 14, 11,  5),( 10,  8,  3),( 24,  0, 25),
+    (  0, 25, 25),(  0, 24, 24),(  0,  0,  7),(  0,  0, 11),( 12,  9,  4),
+    ( 18,  0, 18),( 20,  0, 20),(  0,  0, 13),(  7,  7,  7),( 19, 19, 19),
+    ( 23, 23, 23),( 16, 16, 16),( 12, 12, 12),( 13, 13, 13),( 54, 61, 61),
+    ( 46, 58, 58),( 39, 55, 55),( 29, 50, 50),( 18, 48, 48),(  8, 45, 45),
+    (  8, 44, 44),(  0, 41, 41),(  0, 38, 38),(  0, 35, 35),(  0, 33, 33),
+    (  0, 31, 31),(  0, 30, 30),(  0, 29, 29),(  0, 28, 28),(  0, 27, 27),
+    ( 38,  0, 34)
+])
+
+WolfPal.flags.writeable = False
+SodPal.flags.writeable = False
+
+WolfPalLUT = WolfPal.tobytes()
+SodPalLUT = SodPal.tobytes()
+
+
+class PaletteStore:
+    # Palettes by name and by order added, byte-identical palettes share one (256, 3) array
+    def __init__(self):
+        self.unique = []
+        self.luts = []
+        self.by_bytes = {}
+        self.by_name = {}
+        self.order = []
+
+    def add(self, name, pal):
+        pal = np.ascontiguousarray(pal, dtype=np.uint8).reshape((256, 3))
+        lut = pal.tobytes()
+        idx = self.by_bytes.get(lut)
+        if idx is None:
+            idx = len(self.unique)
+            pal.flags.writeable = False
+            self.unique.append(pal)
+            self.luts.append(lut)
+            self.by_bytes[lut] = idx
+        self.by_name[name] = idx
+        self.order.append(idx)
+        return self.unique[idx]
+
+    def add_vga(self, name, buf):
+        # Raw 768-byte VGA palette chunk, as stored in VGAGRAPH
+        return self.add(name, vga_to_rgb(np.frombuffer(buf, dtype=np.uint8, count=768)))
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, name):
+        return self.unique[self.by_name[name]]
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def lut(self, name):
+        # For PIL's Image.putpalette
+        return self.luts[self.by_name[name]]
+
+    def by_index(self, i):
+        # i-th palette added, as used by sod_pic_palette_map
+        return self.unique[self.order[i]]
+
+
+def palette_image(indices, pal, indexed=False, transparent=None):
+    # Palette-mode ("P") image with the palette attached, or the indices expanded to RGB
+    pal = np.asarray(pal, dtype=np.uint8)
+    if not indexed:
+        return Image.fromarray(pal[indices], 'RGB')
+
+    im = Image.fromarray(np.ascontiguousarray(indices, dtype=np.uint8), 'P')
+    im.putpalette(pal.tobytes())
+    if transparent is not None:
+        # Written as a tRNS chunk
+        im.info["transparency"] = transparent
+    return im
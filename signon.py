@@ -1,11 +1,14 @@
 from pathlib import Path
 
-from PIL import Image
+import numpy as np
 
-from palette import WolfPal, SodPal
+from palette import WolfPal, SodPal, palette_image
+from writer import OutputWriter
 
 
-def extract_signon(sod: bool):
+def extract_signon(sod: bool, indexed=False, output_root: Path = Path("."), writer: OutputWriter = None):
+    writer = writer or OutputWriter()
+
     print("FileIO: SIGNON screen")
 
     hw = 320 * 200
@@ -17,15 +20,13 @@ def extract_signon(sod: bool):
     with open(input_path, 'rb') as fp:
         src = fp.read(hw)
 
-    block = bytearray(hw * 3)
-    for n in range(hw):
-        color_idx = src[n]
-        block[n * 3 + 0] = palette[color_idx][0]
-        block[n * 3 + 1] = palette[color_idx][1]
-        block[n * 3 + 2] = palette[color_idx][2]
+    block = np.frombuffer(src, dtype=np.uint8).reshape((200, 320))
 
-    output_path = Path("signon")
+    output_path = Path(output_root) / "signon"
     output_path.mkdir(parents=True, exist_ok=True)
 
-    im = Image.frombytes('RGB', (320, 200), bytes(block), 'raw')
-    im.save(output_path / "signon.png")
+    if writer.unchanged([output_path / "signon.png"], src, palette, indexed):
+        return
+
+    im = palette_image(block, palette, indexed)
+    writer.save_image(im, output_path / "signon.png")
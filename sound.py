@@ -0,0 +1,63 @@
+import struct
+
+import numpy as np
+
+# Digitized sounds are 8-bit unsigned mono PCM at this rate
+digi_sample_rate = 7042
+
+sample_formats = ["u8", "int16", "float"]
+
+# bits per sample, WAVE format tag
+_wav_formats = {
+    "u8": (8, 1),
+    "int16": (16, 1),
+    "float": (32, 3),
+}
+
+
+def wav_header(data_size, rate, sample_format="u8", channels=1):
+    bits, tag = _wav_formats[sample_format]
+    block_align = channels * bits // 8
+    # Chunks are word aligned, an odd data chunk is followed by a pad byte
+    riff_size = 36 + data_size + (data_size & 1)
+    return struct.pack('<4sL4s4sLHHLLHH4sL', b'RIFF', riff_size, b'WAVE',
+                       b'fmt ', 16, tag, channels, rate, rate * block_align, block_align, bits,
+                       b'data', data_size)
+
+
+def wav_bytes(samples, rate, sample_format="u8"):
+    # samples is a bytes-like object or an array already in sample_format
+    data = memoryview(samples).cast('B')
+    return b"".join([wav_header(len(data), rate, sample_format), data, b"\0" * (len(data) & 1)])
+
+
+def resample_sounds(sounds, src_rate, dst_rate, sample_format="int16"):
+    # Linear interpolation of all 8-bit unsigned sounds in one pass over their concatenated samples.
+    # Returns one array per sound, float32 in [-1, 1) or int16.
+    if not sounds:
+        return []
+
+    lengths = np.array([len(s) for s in sounds], dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    samples = np.concatenate([np.frombuffer(s, dtype=np.uint8) for s in sounds])
+    samples = (samples.astype(np.float32) - 128) / 128
+
+    out_lengths = (lengths * dst_rate + src_rate - 1) // src_rate
+    out_starts = np.cumsum(out_lengths) - out_lengths
+    sound = np.repeat(np.arange(len(sounds)), out_lengths)
+
+    # Source position of every output sample, relative to the start of its sound
+    pos = (np.arange(out_lengths.sum()) - out_starts[sound]) * (src_rate / dst_rate)
+    i0 = pos.astype(np.int64)
+    frac = (pos - i0).astype(np.float32)
+    last = lengths[sound] - 1
+    i1 = starts[sound] + np.minimum(i0 + 1, last)
+    i0 = starts[sound] + np.minimum(i0, last)
+
+    out = samples[i0] * (1 - frac) + samples[i1] * frac
+    if sample_format == "int16":
+        out = np.round(out * 32768).astype(np.int16)
+    elif sample_format != "float":
+        raise ValueError(f"Unsupported sample format for resampling: {sample_format}")
+
+    return np.split(out, out_starts[1:])
@@ -0,0 +1,92 @@
+import contextlib
+import io
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+from manifest import ExtractManifest, manifest_name
+from util import AssetError
+from writer import OutputWriter
+
+
+@dataclass
+class Task:
+    # fn is a module level extract_* function, called as fn(output_root=..., writer=..., **kwargs)
+    # Stages write below output_root, which is created for the task
+    name: str
+    fn: Callable
+    kwargs: dict = field(default_factory=dict)
+    output_root: Path = Path(".")
+    group: str = ""
+
+
+@dataclass
+class TaskResult:
+    name: str
+    group: str
+    ok: bool
+    seconds: float
+    log: str = ""
+    error: str = ""
+    outputs: dict = field(default_factory=dict)  # manifest entries of a successful incremental task
+
+
+def sharded_tasks(name, fn, shards, output_root=Path("."), group="", **kwargs):
+    if shards <= 1:
+        return [Task(name, fn, kwargs, output_root, group)]
+    return [Task(f"{name} {k + 1}/{shards}", fn, dict(kwargs, shard=(k, shards)), output_root, group)
+            for k in range(shards)]
+
+
+def run_task(task: Task, writers=0, queue_depth=64, incremental=False, force=False):
+    # Runs a task with its own writer and captured output. A stage fails by raising, the failure
+    # is returned in the result instead of raised. Incremental tasks skip outputs listed as
+    # unchanged in the manifest of their output root, unless forced.
+    log = io.StringIO()
+    manifest = None
+    t = time.perf_counter()
+    try:
+        output_root = Path(task.output_root)
+        output_root.mkdir(parents=True, exist_ok=True)
+        if incremental:
+            manifest = ExtractManifest(output_root / manifest_name, force)
+        with contextlib.redirect_stdout(log):
+            with OutputWriter(writers, queue_depth, manifest) as writer:
+                task.fn(output_root=output_root, writer=writer, **task.kwargs)
+        ok, error = True, ""
+    except AssetError as e:
+        # Unreadable game data, the message says which
+        ok, error = False, f"AssetError: {e}"
+    except Exception:
+        ok, error = False, traceback.format_exc()
+    outputs = manifest.entries if manifest is not None and ok else {}
+    return TaskResult(task.name, task.group, ok, time.perf_counter() - t, log.getvalue(), error, outputs)
+
+
+def run_tasks(tasks, jobs=1, writers=0, queue_depth=64, show_logs=True, incremental=False, force=False):
+    # Runs independent tasks on one process pool, reporting each one as it finishes.
+    # Without show_logs only the output of failed tasks is printed.
+    results = []
+
+    def report(result: TaskResult):
+        results.append(result)
+        name = f"{result.group}: {result.name}" if result.group else result.name
+        print(f"[{len(results)}/{len(tasks)}] {name}: {'done' if result.ok else 'FAILED'} in {result.seconds:.2f} s")
+        if show_logs or not result.ok:
+            print(result.log, end="")
+        if not result.ok:
+            print(result.error)
+
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(run_task, task, writers, queue_depth, incremental, force) for task in tasks]
+            for future in as_completed(futures):
+                report(future.result())
+    else:
+        for task in tasks:
+            report(run_task(task, writers, queue_depth, incremental, force))
+
+    return results
@@ -0,0 +1,57 @@
+import fnmatch
+import struct
+
+
+class AssetError(Exception):
+    # Game data that can't be read or decoded. Raised by the extraction stages and the asset loaders.
+    pass
+
+
+# What reading and parsing malformed or missing files raises, turned into AssetError by the decoders
+data_errors = (OSError, ValueError, IndexError, struct.error)
+
+
+def or_none(decode, *args):
+    # Decoders raise AssetError, the File_* functions built on them print it and return None
+    try:
+        return decode(*args)
+    except AssetError as e:
+        print(f"FileIO: {e}")
+        return None
+
+
+def close_map(mm, *views):
+    # Releases views and closes a file mapping. With other views still alive (e.g. held by a
+    # traceback) close() refuses, the mapping is then unmapped once the caller drops mm and the
+    # last view is released.
+    for view in views:
+        if view is not None:
+            view.release()
+    if mm is not None:
+        try:
+            mm.close()
+        except BufferError:
+            pass
+
+
+def shard_range(count, shard=None):
+    # Contiguous part k of n of range(count), shard is (k, n)
+    if shard is None:
+        return range(count)
+    k, n = shard
+    return range(count * k // n, count * (k + 1) // n)
+
+
+def select_indices(names, select=None, pattern=None):
+    # Indices into names, limited to a slice and/or to the names matching a glob pattern
+    indices = range(len(names))
+    if select is not None:
+        indices = indices[select]
+    if pattern is not None:
+        indices = [i for i in indices if names[i] is not None and fnmatch.fnmatchcase(names[i], pattern)]
+    return indices
+
+
+def lookup_name(names, i):
+    # Name table entry, None past the end of the table
+    return names[i] if 0 <= i < len(names) else None
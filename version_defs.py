@@ -1,5 +1,6 @@
 import math
 from enum import Enum
+from functools import lru_cache
 
 class VGAChunkType(Enum):
     STRUCTPIC = 0
@@ -11,6 +12,15 @@ class VGAChunkType(Enum):
     DEMO = 6
     PALETTE = 7
 
+
+# Spear of Destiny data files, the mission packs and the demo share its palette
+spear_extensions = [".sod", ".sd1", ".sd2", ".sd3", ".sdm"]
+
+
+def is_spear_file(path):
+    return path.suffix.lower() in spear_extensions
+
+
 # reference: WDC
 wl6_vga_type_range_map = {
     VGAChunkType.STRUCTPIC: [0],
@@ -19,7 +29,7 @@ wl6_vga_type_range_map = {
     VGAChunkType.TILE8: [135],
     VGAChunkType.ENDSCREEN: [136, 137],
     VGAChunkType.ENDART: [138, (143, 148)],
-    VGAChunkType.DEMO: [(139, 148)]
+    VGAChunkType.DEMO: [(139, 142)]
 }
 
 # reference: WDC
@@ -35,24 +45,6 @@ sod_vga_type_range_map = {
 }
 
 
-def get_chunk_type_and_index(chunk, range_map):
-    for t, ra in range_map.items():
-        off = 0
-        for r in ra:
-            if isinstance(r, int):
-                if chunk == r:
-                    return t, off
-                else:
-                    off += 1
-            elif isinstance(r, tuple):
-                if r[0] <= chunk <= r[1]:
-                    return t, chunk - r[0] + off
-                if chunk > r[1]:
-                    off += r[1] - r[0]
-
-    return None, 0
-
-
 def range_to_array(chunk_type: VGAChunkType, range_map):
     arr = []
 
@@ -69,24 +61,72 @@ def range_to_array(chunk_type: VGAChunkType, range_map):
     return arr
 
 
-def range_idx_formant(chunk_type: VGAChunkType, range_map):
-    formant = "{:d}"
+def idx_formant_for_count(n):
+    if n < 10:
+        return "{:d}"
 
-    ra = range_map.get(chunk_type)
-    if ra is None:
-        return formant
+    return f"{{:0{int(math.log10(n)) + 1}d}}"
 
-    n = 0
-    for r in ra:
-        if isinstance(r, int):
-            n += 1
-        elif isinstance(r, tuple):
-            n += r[1] - r[0]
 
-    if n < 10:
-        return formant
+class VGAChunkLayout:
+    # Dense per-chunk tables compiled once from a range map (ranges are inclusive).
+    # If ranges overlap, the type listed first in the range map wins.
+    def __init__(self, range_map, names=None):
+        total = max((c for t in range_map for c in range_to_array(t, range_map)), default=-1) + 1
+        if names is not None:
+            total = max(total, len(names))
 
-    return f"{{:0{int(math.log10(n)) + 1}d}}"
+        self.types = [None] * total
+        self.index = [0] * total
+        self.chunks = {}
+        self.formants = {}
+
+        for chunk_type in range_map:
+            chunks = [c for c in range_to_array(chunk_type, range_map) if self.types[c] is None]
+            for i, chunk in enumerate(chunks):
+                self.types[chunk] = chunk_type
+                self.index[chunk] = i
+            self.chunks[chunk_type] = chunks
+            self.formants[chunk_type] = idx_formant_for_count(len(chunks))
+
+        self.names = list(names) if names is not None else [None] * total
+        self.by_name = {name: chunk for chunk, name in enumerate(self.names) if name is not None}
+
+    def __len__(self):
+        return len(self.types)
+
+    def type_and_index(self, chunk):
+        if not 0 <= chunk < len(self.types) or self.types[chunk] is None:
+            return None, 0
+        return self.types[chunk], self.index[chunk]
+
+    def formant(self, chunk_type: VGAChunkType):
+        return self.formants.get(chunk_type, "{:d}")
+
+    def chunk(self, name):
+        return self.by_name.get(name)
+
+
+# Layouts of the range maps passed to the compatibility wrappers below, compiled on first use.
+# Range maps are keyed by identity, they are module constants and must not be changed afterwards.
+_range_map_layouts = {}
+
+
+def range_map_layout(range_map):
+    range_map_, layout = _range_map_layouts.get(id(range_map), (None, None))
+    if range_map_ is not range_map:
+        layout = VGAChunkLayout(range_map)
+        _range_map_layouts[id(range_map)] = (range_map, layout)
+    return layout
+
+
+# Compatibility wrappers, loops over chunks should use a VGAChunkLayout directly
+def get_chunk_type_and_index(chunk, range_map):
+    return range_map_layout(range_map).type_and_index(chunk)
+
+
+def range_idx_formant(chunk_type: VGAChunkType, range_map):
+    return range_map_layout(range_map).formant(chunk_type)
 
 
 # We could map name->name instead of idx->idx but meh
@@ -131,6 +171,8 @@ sod_ceilings_colors = [
 floor_color = 0x19
 
 # reference: `wl_def.h` / anonymous enum (SPR_*)
+# Name tables are cached and shared between calls, don't modify them
+@lru_cache
 def gen_vswap_name_lookup_table(apogee_1_0=False,
                                 apogee_1_1=False,
                                 spear=False,
@@ -374,7 +416,66 @@ def gen_vswap_name_lookup_table(apogee_1_0=False,
     return sprite_names
 
 
+# reference: `wl_main.c` / wolfdigimap, sound name and digitized sound number.
+# Sounds mapped twice keep the first name.
+@lru_cache
+def gen_digisound_name_lookup_table(spear=False,
+                                    upload=False,
+                                    speardemo=False):
+
+    if not spear:
+        digimap = [
+            ("HALTSND", 0), ("DOGBARKSND", 1), ("CLOSEDOORSND", 2), ("OPENDOORSND", 3),
+            ("ATKMACHINEGUNSND", 4), ("ATKPISTOLSND", 5), ("ATKGATLINGSND", 6), ("SCHUTZADSND", 7),
+            ("GUTENTAGSND", 8), ("MUTTISND", 9), ("BOSSFIRESND", 10), ("SSFIRESND", 11),
+            ("DEATHSCREAM1SND", 12), ("DEATHSCREAM2SND", 13), ("DEATHSCREAM3SND", 13),
+            ("TAKEDAMAGESND", 14), ("PUSHWALLSND", 15),
+            ("LEBENSND", 20), ("NAZIFIRESND", 21), ("SLURPIESND", 22),
+            ("YEAHSND", 32),
+        ]
+
+        if not upload:
+            # These are in all other episodes
+            digimap.extend([
+                ("DOGDEATHSND", 16), ("AHHHGSND", 17), ("DIESND", 18), ("EVASND", 19),
+                ("TOT_HUNDSND", 23), ("MEINGOTTSND", 24), ("SCHABBSHASND", 25), ("HITLERHASND", 26),
+                ("SPIONSND", 27), ("NEINSOVASSND", 28), ("DOGATTACKSND", 29), ("LEVELDONESND", 30),
+                ("MECHSTEPSND", 31),
+                ("SCHEISTSND", 33), ("DEATHSCREAM4SND", 34), ("DEATHSCREAM5SND", 35), ("DONNERSND", 36),
+                ("EINESND", 37), ("ERLAUBENSND", 38), ("DEATHSCREAM6SND", 39), ("DEATHSCREAM7SND", 40),
+                ("DEATHSCREAM8SND", 41), ("DEATHSCREAM9SND", 42), ("KEINSND", 43), ("MEINSND", 44),
+                ("ROSESND", 45),
+            ])
+    else:
+        digimap = [
+            ("HALTSND", 0), ("CLOSEDOORSND", 2), ("OPENDOORSND", 3), ("ATKMACHINEGUNSND", 4),
+            ("ATKPISTOLSND", 5), ("ATKGATLINGSND", 6), ("SCHUTZADSND", 7), ("BOSSFIRESND", 8),
+            ("SSFIRESND", 9), ("DEATHSCREAM1SND", 10), ("DEATHSCREAM2SND", 11), ("TAKEDAMAGESND", 12),
+            ("PUSHWALLSND", 13), ("AHHHGSND", 15), ("LEBENSND", 16), ("NAZIFIRESND", 17),
+            ("SLURPIESND", 18), ("LEVELDONESND", 22),
+            ("DEATHSCREAM4SND", 23), ("DEATHSCREAM3SND", 23), ("DEATHSCREAM5SND", 24),
+            ("DEATHSCREAM6SND", 25), ("DEATHSCREAM7SND", 26), ("DEATHSCREAM8SND", 27),
+            ("DEATHSCREAM9SND", 28), ("GETGATLINGSND", 38),
+        ]
+
+        if not speardemo:
+            digimap.extend([
+                ("DOGBARKSND", 1), ("DOGDEATHSND", 14), ("SPIONSND", 19), ("NEINSOVASSND", 20),
+                ("DOGATTACKSND", 21), ("TRANSSIGHTSND", 29), ("TRANSDEATHSND", 30), ("WILHELMSIGHTSND", 31),
+                ("WILHELMDEATHSND", 32), ("UBERDEATHSND", 33), ("KNIGHTSIGHTSND", 34), ("KNIGHTDEATHSND", 35),
+                ("ANGELSIGHTSND", 36), ("ANGELDEATHSND", 37), ("GETSPEARSND", 39),
+            ])
+
+    sound_names = [None] * (max(digi for _, digi in digimap) + 1)
+    for name, digi in digimap:
+        if sound_names[digi] is None:
+            sound_names[digi] = name
+
+    return sound_names
+
+
 # reference: `gfxv_*.h` / enum graphicnums
+@lru_cache
 def gen_vgagraph_name_lookup_table(apogee_1_0=False,
                                    apogee_1_1=False,
                                    apogee_1_2=False,
@@ -1,16 +1,22 @@
 import math
+import mmap
 import os
 import struct
-import sys
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
+import numpy as np
 from PIL import Image
 
-from palette import RGB, WolfPal, SodPal
+from atlas import pack_pow2_square
+from palette import PaletteStore, WolfPal, SodPal, palette_image
+from util import AssetError, close_map, data_errors, or_none, shard_range, select_indices
 from version_defs import *
+from writer import OutputWriter
 
+# Parts of extract_vga that can run as separate tasks, misc is everything but pictures
+vga_parts = ["pictures", "misc"]
 
 @dataclass
 class wl_picture:
@@ -24,7 +30,25 @@ class VGAContext:
     DictName: Path = Path()
     FileName: Path = Path()
     offset: List[int] = field(default_factory=list)
+    size: List[int] = field(default_factory=list)
     hufftable: List[tuple[int, int]] = field(default_factory=list)
+    huffcompiled: Optional["HuffTable"] = None
+    mm: Optional[mmap.mmap] = None
+    view: Optional[memoryview] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        File_VGA_CloseVgaFiles(self)
+
+
+@dataclass
+class HuffTable:
+    # Indexed by (node << 8) | byte: symbols emitted while walking the byte's 8 bits
+    # from node, and the node the walk ends in (also shifted by 8)
+    symbols: List[bytes]
+    next_node: List[int]
 
 
 def File_HuffExpand(source, target, expanded_size, compressed_size, dictionary):
@@ -70,38 +94,92 @@ def File_HuffExpand(source, target, expanded_size, compressed_size, dictionary):
     return
 
 
-def File_VGA_ReadChunk(ctx: VGAContext, n, chunk_type: VGAChunkType):
-    if n < 0 or n >= ctx.TotalChunks:
-        print(f"FileIO: VGA chunk index out of bounds [0, {ctx.TotalChunks}]: {n}")
-        return None
+def File_HuffCompile(dictionary, head=254):
+    # Walk every node with every 4-bit value first...
+    nibble_symbols = []
+    nibble_next = []
+    for node in range(len(dictionary)):
+        for value in range(16):
+            current_node = node
+            out = bytearray()
+            for bit in range(4):
+                next_node = dictionary[current_node][(value >> bit) & 1]
+                if next_node < 256:
+                    out.append(next_node)
+                    current_node = head
+                else:
+                    current_node = next_node - 256
+            nibble_symbols.append(bytes(out))
+            nibble_next.append(current_node)
+
+    # ...then join two nibble walks per byte (bits are read LSB-first)
+    symbols = []
+    next_node = []
+    for node in range(len(dictionary)):
+        for value in range(256):
+            lo = (node << 4) | (value & 0xF)
+            hi = (nibble_next[lo] << 4) | (value >> 4)
+            symbols.append(nibble_symbols[lo] + nibble_symbols[hi])
+            next_node.append(nibble_next[hi] << 8)
+
+    return HuffTable(symbols, next_node)
+
+
+def File_HuffExpandTable(source, target, expanded_size, compressed_size, table: HuffTable, head=254):
+    symbols = table.symbols
+    next_node = table.next_node
+
+    out = bytearray()
+    node = head << 8
+    for byte in memoryview(source)[:compressed_size]:
+        i = node | byte
+        out += symbols[i]
+        node = next_node[i]
+        if len(out) >= expanded_size:
+            break
 
-    # Find next valid chunk to determine compressed size
-    next_chunk = n + 1
-    while next_chunk < ctx.TotalChunks and ctx.offset[next_chunk] == -1:
-        next_chunk += 1
+    # The last byte may carry bits past the end of the data
+    n = min(len(out), expanded_size)
+    target[:n] = out[:n]
 
-    if next_chunk >= ctx.TotalChunks:
-        compressed_size = os.path.getsize(ctx.FileName) - ctx.offset[n]
-    else:
-        compressed_size = ctx.offset[next_chunk] - ctx.offset[n]
 
-    # Read compressed data
-    with open(ctx.FileName, 'rb') as fp:
-        fp.seek(ctx.offset[n])
-        src = fp.read(compressed_size)
+def chunk_view(ctx: VGAContext, n):
+    if n < 0 or n >= ctx.TotalChunks:
+        raise AssetError(f"VGA chunk index out of bounds [0, {ctx.TotalChunks}]: {n}")
+    if ctx.view is None:
+        raise AssetError("VGA graphics file not opened")
+    if ctx.offset[n] == -1:
+        raise AssetError(f"VGA chunk {n} is missing")
 
-    if not src:
+    # Compressed chunk data, a view into the mapped file
+    return ctx.view[ctx.offset[n]:ctx.offset[n] + ctx.size[n]]
+
+
+def File_VGA_GetChunk(ctx: VGAContext, n):
+    # Missing chunks are None without a message
+    if 0 <= n < ctx.TotalChunks and ctx.offset[n] == -1:
         return None
+    return or_none(chunk_view, ctx, n)
+
+
+def read_chunk(ctx: VGAContext, n, chunk_type: VGAChunkType):
+    src = chunk_view(ctx, n)
+    compressed_size = len(src)
 
     if chunk_type == VGAChunkType.STRUCTPIC:
         expanded = ctx.TotalChunks * 4
     elif chunk_type == VGAChunkType.TILE8:
         expanded = 35 * 64 # BLOCK * NUMTILE8
     else:
+        if compressed_size < 4:
+            raise AssetError(f"VGA chunk {n} has no length header")
         expanded = struct.unpack('<L', src[:4])[0]
+        # A byte holds at most 8 symbols
+        if expanded > 8 * compressed_size:
+            raise AssetError(f"VGA chunk {n} has wrong length {expanded}")
 
     if expanded == 0:
-        return None
+        raise AssetError(f"VGA chunk {n} is empty")
 
     # Skip length bytes
     if chunk_type != VGAChunkType.TILE8:
@@ -109,64 +187,212 @@ def File_VGA_ReadChunk(ctx: VGAContext, n, chunk_type: VGAChunkType):
 
     target = bytearray(expanded)
 
-    File_HuffExpand(src, target, expanded, compressed_size, ctx.hufftable)
+    if ctx.huffcompiled is None:
+        ctx.huffcompiled = File_HuffCompile(ctx.hufftable)
+
+    File_HuffExpandTable(src, target, expanded, compressed_size, ctx.huffcompiled)
     return target
 
 
-def deplane(buf, width, height, palette):
-    buf1 = bytearray(len(buf))
+def File_VGA_ReadChunk(ctx: VGAContext, n, chunk_type: VGAChunkType):
+    src = File_VGA_GetChunk(ctx, n)
+    if not src:
+        return None
+    return or_none(read_chunk, ctx, n, chunk_type)
+
+
+def File_VGA_ReadChunks(ctx: VGAContext, chunks, chunk_type: VGAChunkType):
+    return [File_VGA_ReadChunk(ctx, n, chunk_type) for n in chunks]
+
 
+def deplane_array(buf, width, height, palette=None):
     hw = width * height
     quarter = hw // 4
 
-    # Reorganize the planar data
-    for n in range(hw):
-        buf1[n] = buf[(n % 4) * quarter + n // 4]
+    # Reorganize the planar data: pixel n lives in plane n % 4 at position n // 4
+    planes = np.frombuffer(buf, dtype=np.uint8, count=hw).reshape((4, quarter))
+    indices = planes.T.reshape((height, width))
 
-    # Convert to RGB data
-    buf2 = bytearray(hw * 3)
-
-    for n in range(hw):
-        color_idx = buf1[n]
-        buf2[n * 3 + 0] = palette[color_idx][0]
-        buf2[n * 3 + 1] = palette[color_idx][1]
-        buf2[n * 3 + 2] = palette[color_idx][2]
+    # Palette indices only, when no palette is given
+    if palette is None:
+        return indices.copy()
 
-    return buf2
+    # Convert to RGB data
+    return np.asarray(palette, dtype=np.uint8)[indices]
 
 
-def File_VGA_OpenVgaFiles(ctx: VGAContext, dict_path: Path, header_path: Path, vga_path: Path):
+def deplane(buf, width, height, palette):
+    return bytearray(deplane_array(buf, width, height, palette).tobytes())
+
+
+def parse_font(font):
+    # Font chunk -> height and the glyphs present, as (height, width) views into the chunk
+    v = memoryview(font)
+
+    height = struct.unpack('<h', v[0:2])[0]
+    locs = np.frombuffer(v, dtype='<i2', count=256, offset=2)
+    widths = np.frombuffer(v, dtype='i1', count=256, offset=2 + 256 * 2)
+
+    font_chars = []
+    for i in np.flatnonzero((locs != 0) & (widths != 0)).tolist():
+        loc, width = int(locs[i]), int(widths[i])
+        font_chars.append({
+            "letter": chr(i),
+            "buf": np.frombuffer(v, dtype=np.uint8, count=width * height, offset=loc).reshape((height, width)),
+            "width": width,
+        })
+    return height, font_chars
+
+
+def export_font(font, name, font_path: Path, spacing=1, writer: OutputWriter = None):
+    writer = writer or OutputWriter()
+    height, font_chars = parse_font(font)
+
+    # Pack glyphs into a square power-of-two atlas, with spacing to keep filtering from bleeding
+    side, positions = pack_pow2_square([(fc["width"], height) for fc in font_chars], spacing)
+
+    atlas = np.zeros((side, side, 4), dtype=np.uint8)
+    for fc, (x, y) in zip(font_chars, positions):
+        # Set pixels become opaque white, alternatively: == 0x0F, holds for WL6
+        atlas[y:y + height, x:x + fc["width"]] = np.where(fc["buf"][..., None] != 0x00, 255, 0)
+
+    tex_name = f"{name}.png"
+    im = Image.fromarray(atlas, 'RGBA')
+    writer.save_image(im, font_path / tex_name)
+
+    # https://www.angelcode.com/products/bmfont/doc/file_format.html
+    bmfont = [
+        {
+            "info": {
+                "face": name,
+                "size": height,
+                "bold": 0,
+                "italic": 0,
+                "charset": "",
+                "unicode": 1,
+                "stretchH": 100,
+                "smooth": 0,
+                "aa": 1,
+                "padding": [0, 0, 0, 0],
+                "spacing": [spacing, spacing],
+                "outline": 0
+            }
+        },
+        {
+            "common": {
+                "lineHeight": height,
+                "base": height,
+                "scaleW": side,
+                "scaleH": side,
+                "pages": 1,
+                "packed": 0,
+                "alphaChnl": 0,
+                "redChnl": 0,
+                "greenChnl": 0,
+                "blueChnl": 0,
+            },
+        },
+        {
+            "page": {
+                "id": 0,
+                "file": tex_name
+            },
+        },
+        {
+            "chars": {
+                "count": len(font_chars)
+            }
+        },
+    ]
+
+    for fc, (x, y) in zip(font_chars, positions):
+        bmfont.append({"char": {
+            "id": ord(fc["letter"]),
+            "x": x,
+            "y": y,
+            "width": fc["width"],
+            "height": height,
+            "xoffset": 0,
+            "yoffset": 0,
+            "xadvance": fc["width"],
+            "page": 0,
+            "chnl": 15
+        }})
+
+    lines = []
+    for i in range(len(bmfont)):
+        for tag, attributes in bmfont[i].items():
+            parts = [tag]
+            for key, value in attributes.items():
+                if isinstance(value, list):
+                    parts.append(f"{key}={','.join(map(str, value))}")
+                elif isinstance(value, str):
+                    parts.append(f'{key}="{value}"')
+                else:
+                    parts.append(f"{key}={value}")
+
+            lines.append(' '.join(parts) + '\n')
+
+    writer.write_text(font_path / f"{name}.fnt", ''.join(lines))
+
+
+def map_vga_files(ctx: VGAContext, dict_path: Path, header_path: Path, vga_path: Path):
+    # Reads the dictionary and the chunk offsets and maps the graphics file, raises AssetError if any fails
     if not os.path.isfile(dict_path):
-        print(f"FileIO: graphics dictionary missed: {dict_path}")
-        return 0
+        raise AssetError(f"graphics dictionary missed: {dict_path}")
     if not os.path.isfile(header_path):
-        print(f"FileIO: graphics header missed: {header_path}")
-        return 0
+        raise AssetError(f"graphics header missed: {header_path}")
     if not os.path.isfile(vga_path):
-        print(f"FileIO: VGA graphics file missed: {vga_path}")
-        return 0
+        raise AssetError(f"VGA graphics file missed: {vga_path}")
 
     ctx.HeadName = header_path
     ctx.DictName = dict_path
     ctx.FileName = vga_path
 
-    # Read dictionary file (huffman nodes) (1024 bytes)
-    with open(dict_path, 'rb') as fp:
-        for _ in range(256):
-            bit0, bit1 = struct.unpack('<HH', fp.read(4))
-            ctx.hufftable.append((bit0, bit1))
+    try:
+        # Read dictionary file (huffman nodes) (1024 bytes)
+        with open(dict_path, 'rb') as fp:
+            ctx.hufftable = [struct.unpack('<HH', fp.read(4)) for _ in range(256)]
+
+        # Read header file to get chunks info (3-byte offsets)
+        head = np.fromfile(header_path, dtype=np.uint8)
+        ctx.TotalChunks = len(head) // 3
+        head = head[:ctx.TotalChunks * 3].reshape((-1, 3)).astype(np.int64)
+        offsets = head[:, 0] | (head[:, 1] << 8) | (head[:, 2] << 16)
+        offsets[offsets == 0xFFFFFF] = -1
+        ctx.offset = offsets.tolist()
+
+        with open(vga_path, 'rb') as fp:
+            ctx.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        ctx.view = memoryview(ctx.mm)
+    except data_errors as e:
+        File_VGA_CloseVgaFiles(ctx)
+        raise AssetError(f"Unable to open VGA files: {vga_path} ({e})") from e
+
+    # Nodes past the 255 of the dictionary would send the decoder out of the table
+    if max(max(node) for node in ctx.hufftable) >= 256 + 255:
+        File_VGA_CloseVgaFiles(ctx)
+        raise AssetError(f"Wrong graphics dictionary: {dict_path}")
+
+    # A chunk ends where the next valid chunk starts, the last one at the end of file. Scanning
+    # backwards, missing chunks take the index of the nearest valid one after them.
+    ends = np.append(offsets, len(ctx.mm))
+    following = np.where(ends == -1, len(offsets), np.arange(len(ends)))
+    following = np.minimum.accumulate(following[::-1])[::-1]
+    size = np.where(offsets == -1, 0, ends[following[1:]] - offsets)
+    if (size < 0).any():
+        bad = int(np.flatnonzero(size < 0)[0])
+        File_VGA_CloseVgaFiles(ctx)
+        raise AssetError(f"VGA chunk {bad} at {offsets[bad]} starts past the next chunk: {header_path}")
+    ctx.size = size.tolist()
 
-    # Read header file to get chunks info
-    header_size = os.path.getsize(header_path)
-    ctx.TotalChunks = header_size // 3
 
-    with open(header_path, 'rb') as fp:
-        for _ in range(ctx.TotalChunks):
-            temp = fp.read(3)
-            offset = temp[0] + (temp[1] << 8) + (temp[2] << 16)
-            if offset == 0xFFFFFF:
-                offset = -1
-            ctx.offset.append(offset)
+def File_VGA_OpenVgaFiles(ctx: VGAContext, dict_path: Path, header_path: Path, vga_path: Path):
+    try:
+        map_vga_files(ctx, dict_path, header_path, vga_path)
+    except AssetError as e:
+        print(f"FileIO: {e}")
+        return 0
 
     print("FileIO: VGA graphics files")
     print(f"-> dict: {dict_path}")
@@ -176,293 +402,255 @@ def File_VGA_OpenVgaFiles(ctx: VGAContext, dict_path: Path, header_path: Path, v
     return 1
 
 
-def extract_vga(dict_path: Path, header_path: Path, vga_path: Path):
+def File_VGA_CloseVgaFiles(ctx: VGAContext):
+    close_map(ctx.mm, ctx.view)
+    ctx.mm, ctx.view = None, None
+
+
+def read_pictable(ctx: VGAContext, layout: VGAChunkLayout):
+    # (width, height) of every picture, from the picture definitions chunk
+    buf = read_chunk(ctx, layout.chunks[VGAChunkType.STRUCTPIC][0], VGAChunkType.STRUCTPIC)
+    return np.frombuffer(buf, dtype="<u2").reshape((-1, 2))
+
+
+def read_palettes(ctx: VGAContext, layout: VGAChunkLayout):
+    # Palette chunks as (chunk, raw 768 bytes), in the order sod_pic_palette_map counts them
+    palettes = []
+    for chunk in layout.chunks.get(VGAChunkType.PALETTE, []):
+        buf = read_chunk(ctx, chunk, VGAChunkType.PALETTE)
+        if len(buf) < 768:
+            raise AssetError(f"Palette chunk {chunk} is too short: {len(buf)} bytes")
+        palettes.append((chunk, buf))
+    return palettes
+
+
+def read_font(ctx: VGAContext, n):
+    # Height and glyphs of a font chunk, see parse_font
+    buf = read_chunk(ctx, n, VGAChunkType.FONT)
+    try:
+        return parse_font(buf)
+    except data_errors as e:
+        raise AssetError(f"Unable to parse font chunk {n}: {e}") from e
+
+
+def read_tile8(ctx: VGAContext, n):
+    # (35, 8, 8) palette indices, define NUMTILE8 35
+    v = memoryview(read_chunk(ctx, n, VGAChunkType.TILE8))
+    return np.stack([deplane_array(v[64 * tile:64 * tile + 64], 8, 8) for tile in range(35)])
+
+
+def picture_parts(picnum, spear, count):
+    # Pictures making up picture picnum of count: none for the second part of a SOD split picture,
+    # both parts for the first (320x80 + 320x120 = 320x200), picnum alone otherwise
+    if spear and picnum - 1 in sod_half_pics:
+        return []
+    if spear and picnum in sod_half_pics:
+        if picnum + 1 >= count:
+            raise AssetError(f"Picture {picnum} is missing its second part")
+        return [picnum, picnum + 1]
+    return [picnum]
+
+
+def read_picture(ctx: VGAContext, pic_chunks, pictable, parts):
+    # (height, width) palette indices, parts from picture_parts are stacked top to bottom
+    pics = []
+    for part in parts:
+        if part >= len(pictable):
+            raise AssetError(f"Picture {part} has no size entry")
+        width, height = pictable[part].tolist()
+        if not (1 <= width <= 320 and 1 <= height <= 200) or width * height % 4:
+            raise AssetError(f"Picture {part} has wrong size {width}x{height}")
+
+        buf = read_chunk(ctx, pic_chunks[part], VGAChunkType.PICTURE)
+        if len(buf) < width * height:
+            raise AssetError(f"Picture {part} is too short for {width}x{height}: {len(buf)} bytes")
+        pics.append(deplane_array(buf, width, height))
+
+    if len({pic.shape[1] for pic in pics}) > 1:
+        raise AssetError(f"Picture {parts[0]} parts differ in width")
+    return np.concatenate(pics) if len(pics) > 1 else pics[0]
+
+
+def picture_palette(picnum, spear, palettes: PaletteStore, default):
+    # Some SOD pictures are shown with one of the palette chunks, all others with the game palette
+    pal_idx = sod_pic_palette_map.get(picnum) if spear else None
+    if pal_idx is None:
+        return default
+    if pal_idx >= len(palettes):
+        raise AssetError(f"Picture {picnum} uses palette {pal_idx}, {len(palettes)} read")
+    return palettes.by_index(pal_idx)
+
+
+def iter_pictures(dict_path: Path, header_path: Path, vga_path: Path, select=None, pattern=None, expand=False):
+    # Lazily decoded pictures as (index, name, data), data is (height, width) palette indices, or
+    # RGB in the picture's own palette with expand. select is a slice of the pictures and pattern
+    # a glob on their names. SOD pictures split in two come as one, their second part is skipped.
+    # Pictures that can't be decoded raise AssetError.
+    spear = is_spear_file(Path(dict_path))
+    palette = SodPal if spear else WolfPal
+    names = gen_vgagraph_name_lookup_table(wl6=not spear, sod=spear)
+    layout = VGAChunkLayout(sod_vga_type_range_map if spear else wl6_vga_type_range_map, names)
+
+    ctx = VGAContext()
+    map_vga_files(ctx, dict_path, header_path, vga_path)
+
+    with ctx:
+        pictable = read_pictable(ctx, layout)
+
+        # Palettes are only read if a picture needs one
+        external_palettes = None
+
+        pic_chunks = [chunk for chunk in layout.chunks.get(VGAChunkType.PICTURE, []) if chunk < ctx.TotalChunks]
+        for picnum in select_indices([names[chunk] for chunk in pic_chunks], select, pattern):
+            parts = picture_parts(picnum, spear, len(pic_chunks))
+            if not parts:
+                continue
+
+            pic = read_picture(ctx, pic_chunks, pictable, parts)
+            if not expand:
+                yield picnum, names[pic_chunks[picnum]], pic
+                continue
+
+            if spear and external_palettes is None and sod_pic_palette_map.get(picnum) is not None:
+                external_palettes = PaletteStore()
+                for chunk, buf in read_palettes(ctx, layout):
+                    external_palettes.add_vga(names[chunk], buf)
+            pic_palette = picture_palette(picnum, spear, external_palettes, palette)
+            yield picnum, names[pic_chunks[picnum]], pic_palette[pic]
+
+
+def extract_vga(dict_path: Path, header_path: Path, vga_path: Path, indexed=False, parts=vga_parts, shard=None,
+                output_root: Path = Path("."), writer: OutputWriter = None):
+    # shard (k, n) limits pictures to part k of n, outputs are written below output_root
+    ctx = VGAContext()
+
+    if not File_VGA_OpenVgaFiles(ctx, dict_path, header_path, vga_path):
+        raise AssetError(f"Failed to open VGA files: {vga_path}")
+
+    with ctx:
+        _extract_vga_chunks(ctx, is_spear_file(dict_path), indexed, parts, shard, Path(output_root), writer)
+
+
+def _extract_vga_chunks(ctx: VGAContext, spear, indexed=False, parts=vga_parts, shard=None,
+                        output_root: Path = Path("."), writer: OutputWriter = None):
+    writer = writer or OutputWriter()
+
     # Create output directories
-    font_path = Path("vga/fonts")
+    font_path = output_root / "vga/fonts"
     font_path.mkdir(parents=True, exist_ok=True)
 
-    pics_path = Path("vga/pics")
+    pics_path = output_root / "vga/pics"
     pics_path.mkdir(parents=True, exist_ok=True)
 
-    tile8_path = Path("vga/tile8")
+    tile8_path = output_root / "vga/tile8"
     tile8_path.mkdir(parents=True, exist_ok=True)
 
-    endscreens_path = Path("vga/endscreens")
+    endscreens_path = output_root / "vga/endscreens"
     endscreens_path.mkdir(parents=True, exist_ok=True)
 
-    demos_path = Path("vga/demos")
+    demos_path = output_root / "vga/demos"
     demos_path.mkdir(parents=True, exist_ok=True)
 
-    endarts_path = Path("vga/endarts")
+    endarts_path = output_root / "vga/endarts"
     endarts_path.mkdir(parents=True, exist_ok=True)
 
-    palettes_path = Path("vga/palettes")
+    palettes_path = output_root / "vga/palettes"
     palettes_path.mkdir(parents=True, exist_ok=True)
 
-    spear = True if dict_path.suffix.lower() == ".sod" else False
-
-    ctx = VGAContext()
-
     palette = SodPal if spear else WolfPal
     names = gen_vgagraph_name_lookup_table(wl6=not spear, sod=spear)
     range_map = sod_vga_type_range_map if spear else wl6_vga_type_range_map
-
-    if not File_VGA_OpenVgaFiles(ctx, dict_path, header_path, vga_path):
-        print("Failed to open VGA files")
-        sys.exit(1)
+    layout = VGAChunkLayout(range_map, names)
 
     # Read picture definitions from chunk 0
-    buf = File_VGA_ReadChunk(ctx, range_map[VGAChunkType.STRUCTPIC][0], VGAChunkType.STRUCTPIC)
-    if buf is None:
-        print("Failed to read picture definitions chunk")
-        return
-
-    pictable = []
-    for i in range(ctx.TotalChunks):
-        width = struct.unpack('<H', buf[i * 4:i * 4 + 2])[0]
-        height = struct.unpack('<H', buf[i * 4 + 2:i * 4 + 4])[0]
-        pictable.append(wl_picture(width, height))
+    pictable = read_pictable(ctx, layout)
 
     # Read palettes ahead of time for SOD
-    external_palettes = []
-    for chunk in range_to_array(VGAChunkType.PALETTE, range_map):
-        buf = File_VGA_ReadChunk(ctx, chunk, VGAChunkType.PALETTE)
-        with open(palettes_path / f"{names[chunk]}.lmp", 'wb') as fp:
-            fp.write(buf)
+    external_palettes = PaletteStore()
+    for chunk, buf in read_palettes(ctx, layout):
+        lmp_file = palettes_path / f"{names[chunk]}.lmp"
+        if "misc" in parts and not writer.unchanged([lmp_file], File_VGA_GetChunk(ctx, chunk)):
+            writer.write_bytes(lmp_file, buf)
 
-        v = memoryview(buf)
+        external_palettes.add_vga(names[chunk], buf)
 
-        external_palette = []
-        for i in range(0, 256):
-            r = struct.unpack('<B', v[i * 3 + 0:i * 3 + 1])[0]
-            g = struct.unpack('<B', v[i * 3 + 1:i * 3 + 2])[0]
-            b = struct.unpack('<B', v[i * 3 + 2:i * 3 + 3])[0]
-            external_palette.append(RGB(r, g, b))
+    if len(external_palettes):
+        print(f"-> Palettes: {len(external_palettes)} ({len(external_palettes.unique)} unique)")
 
-        external_palettes.append(external_palette)
+    all_pic_chunks = layout.chunks.get(VGAChunkType.PICTURE, [])
+    pic_chunks = {all_pic_chunks[i] for i in shard_range(len(all_pic_chunks), shard)} if "pictures" in parts else set()
 
     for chunk in range(1, ctx.TotalChunks - 1):
-        chunk_type, chunk_idx = get_chunk_type_and_index(chunk, range_map)
+        chunk_type, chunk_idx = layout.type_and_index(chunk)
+        if chunk_type == VGAChunkType.PICTURE and chunk not in pic_chunks:
+            continue
+        if chunk_type != VGAChunkType.PICTURE and "misc" not in parts:
+            continue
         if chunk_type is None:
             print(f"unknown vgagraph chunk: {chunk}")
             continue
 
-        idx_formant = range_idx_formant(chunk_type, range_map)
+        idx_formant = layout.formant(chunk_type)
         name = names[chunk]
 
         # REFACTOR: move File_VGA_ReadChunk outside, DRY
         if chunk_type == VGAChunkType.FONT:
-            font = File_VGA_ReadChunk(ctx, chunk, chunk_type)
-            v = memoryview(font)
-
-            font_chars = []
-
-            height = struct.unpack('<h', v[0:2])[0]
-            for i in range(256):
-                loc = struct.unpack('<h', v[2 + (i * 2):2 + (i * 2 + 2)])[0]
-                width = struct.unpack('<b', v[(2 + 256 * 2) + i:(2 + 256 * 2) + i + 1])[0]
-
-                if loc == 0 or width == 0:
-                    continue
-
-                font_chars.append({
-                    "letter": chr(i),
-                    "buf": memoryview(v[loc:loc + width * height]),
-                    "width": width,
-                })
-
-            # TODO: save as optimized "power of two" cells instead of one line
-
-            total_width = sum(fc["width"] for fc in font_chars)
-            buf = bytearray(height * total_width * 4)
-
-            for y in range(height):
-                stride = 0
-                for fc in font_chars:
-                    for x in range(fc["width"]):
-                        i = y * fc["width"] + x
-                        j = (y * total_width + x + stride) * 4
-                        if fc["buf"][i] != 0x00:  # alternatively: == 0x0F, holds for WL6
-                            buf[j + 0] = 255
-                            buf[j + 1] = 255
-                            buf[j + 2] = 255
-                            buf[j + 3] = 255
-                        else:
-                            buf[j + 0] = 0
-                            buf[j + 1] = 0
-                            buf[j + 2] = 0
-                            buf[j + 3] = 0
-
-                    stride += fc["width"]
-
-            tex_name = f"{name}.png"
-            im = Image.frombytes('RGBA', (total_width, height), bytes(buf), 'raw')
-            im.save(font_path / tex_name)
-
-            # https://www.angelcode.com/products/bmfont/doc/file_format.html
-            bmfont = [
-                {
-                    "info": {
-                        "face": name,
-                        "size": height,
-                        "bold": 0,
-                        "italic": 0,
-                        "charset": "",
-                        "unicode": 1,
-                        "stretchH": 100,
-                        "smooth": 0,
-                        "aa": 1,
-                        "padding": [0, 0, 0, 0],
-                        "spacing": [0, 0],  # [1,1] ?
-                        "outline": 0
-                    }
-                },
-                {
-                    "common": {
-                        "lineHeight": height,
-                        "base": height,
-                        "scaleW": total_width,
-                        "scaleH": height,
-                        "pages": 1,
-                        "packed": 0,
-                        "alphaChnl": 0,
-                        "redChnl": 0,
-                        "greenChnl": 0,
-                        "blueChnl": 0,
-                    },
-                },
-                {
-                    "page": {
-                        "id": 0,
-                        "file": tex_name
-                    },
-                },
-                {
-                    "chars": {
-                        "count": len(font_chars)
-                    }
-                },
-            ]
-
-            x = 0
-            for fc in font_chars:
-                bmfont.append({"char": {
-                    "id": ord(fc["letter"]),
-                    "x": x,
-                    "y": 0,
-                    "width": fc["width"],
-                    "height": height,
-                    "xoffset": 0,
-                    "yoffset": 0,
-                    "xadvance": fc["width"],
-                    "page": 0,
-                    "chnl": 15
-                }})
-                x += fc["width"]
-
-            with open(font_path / f"{name}.fnt", 'w') as fnt_file:
-                for i in range(len(bmfont)):
-                    for tag, attributes in bmfont[i].items():
-                        parts = [tag]
-                        for key, value in attributes.items():
-                            if isinstance(value, list):
-                                parts.append(f"{key}={','.join(map(str, value))}")
-                            elif isinstance(value, str):
-                                parts.append(f'{key}="{value}"')
-                            else:
-                                parts.append(f"{key}={value}")
-
-                        fnt_file.write(' '.join(parts) + '\n')
+            if writer.unchanged([font_path / f"{name}.png", font_path / f"{name}.fnt"],
+                                File_VGA_GetChunk(ctx, chunk)):
+                continue
+            font = read_chunk(ctx, chunk, chunk_type)
+            export_font(font, name, font_path, writer=writer)
 
         elif chunk_type == VGAChunkType.PICTURE:
-            def read_pic(chunk_idx_, chunk_):
-                wl_pic = pictable[chunk_idx_]
-                assert (320 >= wl_pic.width >= 1 <= wl_pic.height <= 200)
-
-                buf_ = File_VGA_ReadChunk(ctx, chunk_, chunk_type)
-
-                palette_ = palette
-
-                if spear:
-                    pal_idx = sod_pic_palette_map.get(chunk_idx_)
-                    if pal_idx is not None:
-                        palette_ = external_palettes[pal_idx]
-
-                return (wl_pic.width, wl_pic.height), deplane(buf_, wl_pic.width, wl_pic.height, palette_)
-
-            # Skip second part of the picture
-            if spear and chunk_idx - 1 in sod_half_pics:
+            # Skip second part of the picture, it's merged into the first
+            pic_parts = picture_parts(chunk_idx, spear, len(all_pic_chunks))
+            if not pic_parts:
                 continue
 
-            size, buf = read_pic(chunk_idx, chunk)
-
-            # Merge two parts into one picture (320x80 + 320x120 = 320x200)
-            if spear and chunk_idx in sod_half_pics:
-                size1, buf1 = read_pic(chunk_idx + 1, chunk + 1)
-                assert (size[0] == size1[0] == 320)
-                assert (size[1] == 80 and size1[1] == 120)
-                buf.extend(buf1)
-                size = (size[0], size[1] + size1[1])
+            # Both parts use the same palette
+            pic_palette = picture_palette(chunk_idx, spear, external_palettes, palette)
 
-            im = Image.frombytes('RGB', size, bytes(buf), 'raw')
-            im.save(pics_path / f"{idx_formant.format(chunk_idx)}_{name}.png")
+            pic_file = pics_path / f"{idx_formant.format(chunk_idx)}_{name}.png"
+            if writer.unchanged([pic_file], *[File_VGA_GetChunk(ctx, all_pic_chunks[p]) for p in pic_parts],
+                                pictable[pic_parts], pic_palette, indexed):
+                continue
 
+            pic = read_picture(ctx, all_pic_chunks, pictable, pic_parts)
+            im = palette_image(pic, pic_palette, indexed)
+            writer.save_image(im, pic_file)
 
         elif chunk_type == VGAChunkType.TILE8:
-            buf = File_VGA_ReadChunk(ctx, chunk, chunk_type)
-            v = memoryview(buf)
-
-            tiles = []
-
-            for tile in range(0, 35): #define NUMTILE8 35
-                tile_buf = deplane(v[64 * tile:64 * tile + 64], 8, 8, palette)
-                tiles.append(tile_buf)
+            if writer.unchanged([tile8_path / "WINDOW.png"], File_VGA_GetChunk(ctx, chunk), palette, indexed):
+                continue
+            tiles = read_tile8(ctx, chunk)
 
             # Generate nine-patch (3x3 tiles) rectangle texture for window borders
             # Assume white background for the missing middle tile
             # TODO: Consider extracting TILE8 font (it's not used anywhere in WOLF3D code)
 
-            blank_tile = bytearray(b'\xFF') * (8 ** 2) * 3
+            blank_tile = np.full((8, 8), 15, dtype=np.uint8)  # white in both palettes
 
             window_tiles = [
-                tiles[0], tiles[1], tiles[2],
-                tiles[3], blank_tile, tiles[4],
-                tiles[5], tiles[6], tiles[7],
+                [tiles[0], tiles[1], tiles[2]],
+                [tiles[3], blank_tile, tiles[4]],
+                [tiles[5], tiles[6], tiles[7]],
             ]
 
-            patch_buf = bytearray(((8 * 3) ** 2) * 3)
-
-            for tiley in range(0, 3):
-                for tilex in range(0, 3):
-                    window_tile = window_tiles[tiley * 3 + tilex]
-                    for y in range(0, 8):
-                        patchy = tiley * 8 + y
-                        for x in range(0, 8):
-                            patchx = tilex * 8 + x
-                            i = y * 8 + x
-                            j = patchy * (8 * 3) + patchx
-                            patch_buf[j * 3 + 0] = window_tile[i * 3 + 0]
-                            patch_buf[j * 3 + 1] = window_tile[i * 3 + 1]
-                            patch_buf[j * 3 + 2] = window_tile[i * 3 + 2]
-
-            im = Image.frombytes('RGB', (8 * 3, 8 * 3), bytes(patch_buf), 'raw')
-            im.save(tile8_path / f"WINDOW.png")
-
-        elif chunk_type == VGAChunkType.ENDSCREEN:
-            endscreen = File_VGA_ReadChunk(ctx, chunk, chunk_type)
-            with open(endscreens_path / f"{name}.bin", 'wb') as fp:
-                fp.write(endscreen)
-
-        elif chunk_type == VGAChunkType.ENDART:
-            endart = File_VGA_ReadChunk(ctx, chunk, chunk_type)
-            with open(endarts_path / f"{name}.txt", 'wb') as fp:
-                fp.write(endart)
-
-        elif chunk_type == VGAChunkType.DEMO:
-            demo = File_VGA_ReadChunk(ctx, chunk, chunk_type)
-            with open(demos_path / f"{name}.bin", 'wb') as fp:
-                fp.write(demo)
+            patch = np.concatenate([np.concatenate(row, axis=1) for row in window_tiles])
+
+            im = palette_image(patch, palette, indexed)
+            writer.save_image(im, tile8_path / f"WINDOW.png")
+
+        elif chunk_type in (VGAChunkType.ENDSCREEN, VGAChunkType.ENDART, VGAChunkType.DEMO):
+            data_file = {
+                VGAChunkType.ENDSCREEN: endscreens_path / f"{name}.bin",
+                VGAChunkType.ENDART: endarts_path / f"{name}.txt",
+                VGAChunkType.DEMO: demos_path / f"{name}.bin",
+            }[chunk_type]
+            if writer.unchanged([data_file], File_VGA_GetChunk(ctx, chunk)):
+                continue
+            writer.write_bytes(data_file, read_chunk(ctx, chunk, chunk_type))
 
         elif chunk_type == VGAChunkType.PALETTE:
             # Already saved
-            continue
\ No newline at end of file
+            continue
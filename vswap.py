@@ -1,15 +1,24 @@
+import json
 import math
+import mmap
 import os
 import struct
-import sys
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
+import numpy as np
 from PIL import Image
 
-from palette import WolfPal, SodPal
-from version_defs import gen_vswap_name_lookup_table
+from atlas import next_pow2, pack_pow2_square
+from palette import WolfPal, SodPal, palette_image
+from sound import digi_sample_rate, resample_sounds, wav_bytes
+from util import AssetError, close_map, data_errors, lookup_name, or_none, shard_range, select_indices
+from version_defs import gen_vswap_name_lookup_table, gen_digisound_name_lookup_table, is_spear_file
+from writer import OutputWriter
+
+# Parts of extract_vswap that can run as separate tasks
+vswap_parts = ["walls", "sprites", "sounds"]
 
 @dataclass
 class Shape:
@@ -17,6 +26,20 @@ class Shape:
     rightpix: int
     dataofs: List[int]  # Array of 64 unsigned short offsets
 
+# Vertical run of opaque pixels in one column, source_offset is the page offset of y_start
+sprite_span_dtype = np.dtype([
+    ("column", "<u2"),
+    ("y_start", "<u2"),
+    ("y_end", "<u2"),
+    ("source_offset", "<u2"),
+])
+
+# Last page of the file, one entry per digitized sound. start_page is relative to SoundStart.
+digimap_dtype = np.dtype([
+    ("start_page", "<u2"),
+    ("length", "<u2"),
+])
+
 @dataclass
 class Chunk:
     offset: int = 0
@@ -30,217 +53,582 @@ class VSwapContext:
     Pages: List[Chunk] = field(default_factory=list)
     FileName: Path = Path()
     names: List[str] = field(default_factory=list)
+    mm: Optional[mmap.mmap] = None
+    view: Optional[memoryview] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        File_PML_ClosePageFile(self)
+
+
+def Img_BoxSum3x3(a):
+    # Sum over each pixel's 3x3 neighbourhood, outside of the image counts as zero
+    h, w = a.shape[:2]
+    p = np.pad(a, ((1, 1), (1, 1)) + ((0, 0),) * (a.ndim - 2))
+    out = np.zeros_like(p[1:-1, 1:-1])
+    for dy in range(3):
+        for dx in range(3):
+            out += p[dy:dy + h, dx:dx + w]
+    return out
+
+
+def Img_ExpandPaletteArray(src, w, h, pal=None, transparent=True, bleed=1):
+    if not isinstance(src, np.ndarray):
+        src = np.frombuffer(src, dtype=np.uint8)
+    src = src.reshape((h, w))
+    rgb = np.asarray(pal, dtype=np.uint8)[src]
+    if not transparent:
+        return rgb
+
+    # Transparent pixels take the average color of their opaque neighbours, so
+    # filtering doesn't pull in dark fringes. Each extra bleed pass grows that
+    # border by one pixel, using the previous pass as neighbours.
+    opaque = src != 255
+    filled = opaque.copy()
+    colors = rgb.astype(np.uint32)
+    colors[~opaque] = 0
+    for _ in range(bleed):
+        sums = Img_BoxSum3x3(colors)
+        counts = Img_BoxSum3x3(filled.astype(np.uint32))
+        new = ~filled & (counts > 0)
+        if not new.any():
+            break
+        colors[new] = sums[new] // counts[new][:, None]
+        filled |= new
+
+    alpha = np.where(opaque, 255, 0).astype(np.uint8)
+    return np.dstack([colors.astype(np.uint8), alpha])
+
+
+def Img_ExpandPalette(dst, src, w, h, pal=None, transparent=True, bleed=1):
+    dst.extend(Img_ExpandPaletteArray(src, w, h, pal, transparent, bleed).tobytes())
+
+
+def map_page_file(ctx: VSwapContext, filename: Path):
+    # Maps the page file and reads its page table, raises AssetError if either fails
+    try:
+        with open(filename, 'rb') as fp:
+            ctx.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        ctx.view = memoryview(ctx.mm)
+
+        ctx.ChunksInFile, ctx.SpriteStart, ctx.SoundStart = struct.unpack_from('<HHH', ctx.mm, 0)
+        offsets = struct.unpack_from(f'<{ctx.ChunksInFile}L', ctx.mm, 6)
+        lengths = struct.unpack_from(f'<{ctx.ChunksInFile}H', ctx.mm, 6 + ctx.ChunksInFile * 4)
+    except data_errors as e:
+        File_PML_ClosePageFile(ctx)
+        raise AssetError(f"Unable to open page file: {filename} ({e})") from e
 
+    if not ctx.SpriteStart <= ctx.SoundStart < ctx.ChunksInFile:
+        File_PML_ClosePageFile(ctx)
+        raise AssetError(f"Page file has wrong header: {filename}")
 
-def Img_ExpandPalette(dst, src, w, h, pal=None, transparent=True):
-    ssrc = src[:]
-    for y in range(h):
-        for x in range(w):
-            srcp = src[y * w + x]
-            if transparent and srcp == 255:
-                r = g = b = c = 0
-                for v in range(y - 1, y + 2):
-                    for u in range(x - 1, x + 2):
-                        if 0 <= u < w and 0 <= v < h:
-                            i = ssrc[v * w + u]
-                            if i != 255:
-                                r += pal[i][0]
-                                g += pal[i][1]
-                                b += pal[i][2]
-                                c += 1
-                c = max(c, 1)
-                dst.extend([r // c, g // c, b // c, 0])
-            else:
-                dst.extend([pal[srcp][0], pal[srcp][1], pal[srcp][2]])
-                if transparent:
-                    dst.append(255)
+    ctx.FileName = filename
+    ctx.Pages = [Chunk(offset, length) for offset, length in zip(offsets, lengths)]
 
 
 def File_PML_OpenPageFile(ctx: VSwapContext, filename: Path):
     try:
-        with open(filename, 'rb') as fp:
-            ctx.FileName = filename
+        map_page_file(ctx, filename)
+    except AssetError as e:
+        print(f"FileIO: {e}")
+        return 0
 
-            header = fp.read(6)
-            ctx.ChunksInFile, ctx.SpriteStart, ctx.SoundStart = struct.unpack('<HHH', header)
+    print(f"FileIO: Page File")
+    print(f"-> Total Chunks : {ctx.ChunksInFile}")
+    print(f"-> Sprites start: {ctx.SpriteStart}")
+    print(f"-> Sounds start : {ctx.SoundStart}")
 
-            print(f"FileIO: Page File")
-            print(f"-> Total Chunks : {ctx.ChunksInFile}")
-            print(f"-> Sprites start: {ctx.SpriteStart}")
-            print(f"-> Sounds start : {ctx.SoundStart}")
+    return 1
 
-            ctx.Pages = [Chunk() for _ in range(ctx.ChunksInFile)]
 
-            for i in range(ctx.ChunksInFile):
-                ctx.Pages[i].offset = struct.unpack('<L', fp.read(4))[0]
+def File_PML_ClosePageFile(ctx: VSwapContext):
+    close_map(ctx.mm, ctx.view)
+    ctx.mm, ctx.view = None, None
 
-            for i in range(ctx.ChunksInFile):
-                tmp = struct.unpack('<H', fp.read(2))[0]
-                ctx.Pages[i].length = tmp
 
-        return 1
-    except FileNotFoundError:
-        print(f"FileIO: Unable to open page file: {filename}")
-        return 0
+def page_view(ctx: VSwapContext, n):
+    if ctx.view is None:
+        raise AssetError("Page file not opened")
+    if not 0 <= n < ctx.ChunksInFile:
+        raise AssetError(f"Wrong chunk num {n}")
+    if not ctx.Pages[n].length or not ctx.Pages[n].offset:
+        raise AssetError(f"Page {n} wrong header data")
+
+    page = ctx.view[ctx.Pages[n].offset:ctx.Pages[n].offset + ctx.Pages[n].length]
+    if len(page) != ctx.Pages[n].length:
+        raise AssetError(f"Page {n} read error")
+    return page
+
+
+def File_PML_GetPage(ctx: VSwapContext, n):
+    return or_none(page_view, ctx, n)
 
 
 def File_PML_ReadPage(ctx: VSwapContext, n, data):
-    if not ctx.FileName:
-        print("FileIO: Page file not opened")
-        return 0
-    if n >= ctx.ChunksInFile:
-        print(f"FileIO: Wrong chunk num {n}")
-        return 0
-    if not ctx.Pages[n].length or not ctx.Pages[n].offset:
-        print(f"FileIO: Page {n} wrong header data")
-        return 0
     if data is None:
         print("FileIO: Bad Pointer!")
         return 0
 
-    with open(ctx.FileName, 'rb') as fp:
-        fp.seek(ctx.Pages[n].offset)
-        chunk_data = fp.read(ctx.Pages[n].length)
-        data[:] = chunk_data
-        if len(chunk_data) != ctx.Pages[n].length:
-            print(f"FileIO: Page {n} read error")
-            return 0
+    page = File_PML_GetPage(ctx, n)
+    if page is None:
+        return 0
+
+    data[:] = page
     return 1
 
 
-def File_PML_LoadWall(ctx: VSwapContext, n, block, palette=WolfPal):
-    if n >= ctx.SpriteStart:
-        print(f"FileIO: Wall index ({n}) out of bounds [0-{ctx.SpriteStart}]")
-        return 0
+def wall_indices(ctx: VSwapContext, n):
+    if not 0 <= n < ctx.SpriteStart:
+        raise AssetError(f"Wall index ({n}) out of bounds [0-{ctx.SpriteStart}]")
+
+    data = page_view(ctx, n)
+    if len(data) != 64 * 64:
+        raise AssetError(f"Wall {n} has wrong size {len(data)}")
+
+    # Walls are stored column-major
+    return np.frombuffer(data, dtype=np.uint8).reshape((64, 64)).T
+
+
+def File_PML_LoadWallIndices(ctx: VSwapContext, n):
+    return or_none(wall_indices, ctx, n)
+
 
-    data = bytearray(ctx.Pages[n].length)
-    if not File_PML_ReadPage(ctx, n, data):
+def File_PML_LoadWall(ctx: VSwapContext, n, block, palette=WolfPal):
+    indices = File_PML_LoadWallIndices(ctx, n)
+    if indices is None:
         return 0
 
-    for x in range(64):
-        for y in range(64):
-            val = data[(x << 6) + y]
-            idx = ((y << 6) + x) * 3
-            block[idx + 0] = palette[val][0]
-            block[idx + 1] = palette[val][1]
-            block[idx + 2] = palette[val][2]
+    block[:] = np.asarray(palette, dtype=np.uint8)[indices].tobytes()
     return 1
 
 
-def File_PML_LoadSprite(ctx: VSwapContext, n, block, palette=WolfPal):
+def File_PML_LoadWalls(ctx: VSwapContext, palette=WolfPal):
+    # All walls as one (N, 64, 64, 3) array, unreadable walls are left black.
+    # Palette indices only, when no palette is given.
+    indices = np.zeros((ctx.SpriteStart, 64, 64), dtype=np.uint8)
+    loaded = np.zeros(ctx.SpriteStart, dtype=bool)
+    for i in range(ctx.SpriteStart):
+        wall = File_PML_LoadWallIndices(ctx, i)
+        if wall is not None:
+            indices[i] = wall
+            loaded[i] = True
+
+    if palette is None:
+        return indices
+
+    walls = np.asarray(palette, dtype=np.uint8)[indices]
+    walls[~loaded] = 0
+    return walls
+
+
+def compile_sprite(ctx: VSwapContext, n):
     if n < ctx.SpriteStart or n >= ctx.SoundStart:
-        print(f"FileIO: Sprite index ({n}) out of bounds [{ctx.SpriteStart}-{ctx.SoundStart}]")
-        return 0
+        raise AssetError(f"Sprite index ({n}) out of bounds [{ctx.SpriteStart}-{ctx.SoundStart}]")
 
-    sprite = bytearray(ctx.Pages[n].length)
-    if not File_PML_ReadPage(ctx, n, sprite):
-        return 0
+    sprite = page_view(ctx, n)
+    if len(sprite) < 4:
+        raise AssetError(f"Sprite {n} has no shape header")
 
-    # Initialize all as transparent
-    tmp = bytearray([255] * (64 * 64))
+    leftpix, rightpix = struct.unpack_from('<HH', sprite, 0)
+    if not leftpix <= rightpix < 64 or len(sprite) < 4 + (rightpix - leftpix + 1) * 2:
+        raise AssetError(f"Sprite {n} has wrong shape header [{leftpix}-{rightpix}]")
 
     shape = Shape(
-        leftpix=int.from_bytes(sprite[0:2], byteorder='little', signed=False),
-        rightpix=int.from_bytes(sprite[2:4], byteorder='little', signed=False),
-        dataofs=[int.from_bytes(sprite[4 + i * 2:6 + i * 2], byteorder='little', signed=False) for i in range(64)]
+        leftpix=leftpix,
+        rightpix=rightpix,
+        dataofs=list(struct.unpack_from(f'<{rightpix - leftpix + 1}H', sprite, 4)),
     )
 
-    # Process each column from leftpix to rightpix
-    for x in range(shape.leftpix, shape.rightpix + 1):
-        # Get command pointer offset
-        cmd_offset = shape.dataofs[x - shape.leftpix]
+    spans = []
 
-        # Process line commands
-        pos = cmd_offset
+    # Process each column from leftpix to rightpix
+    for x, pos in enumerate(shape.dataofs, shape.leftpix):
+        # Process line commands (3 shorts each, a zero ends the column)
         while True:
-            # Read command values (3 shorts)
-            cmd0 = int.from_bytes(sprite[pos:pos + 2], byteorder='little', signed=True)
-            if cmd0 == 0:  # End of commands for this column
+            if pos + 2 > len(sprite):
+                raise AssetError(f"Sprite {n} column {x} runs past the page")
+            cmd0, = struct.unpack_from('<h', sprite, pos)
+            if cmd0 == 0:
                 break
 
-            cmd1 = int.from_bytes(sprite[pos + 2:pos + 4], byteorder='little', signed=True)
-            cmd2 = int.from_bytes(sprite[pos + 4:pos + 6], byteorder='little', signed=True)
-            pos += 6  # Move to next command
+            if pos + 6 > len(sprite):
+                raise AssetError(f"Sprite {n} column {x} runs past the page")
+            cmd1, cmd2 = struct.unpack_from('<hh', sprite, pos + 2)
+            pos += 6
+
+            y_start, y_end = cmd2 // 2, cmd0 // 2
+            if y_end > y_start:
+                # Posts have to stay inside the shape and take their pixels from the page
+                if y_start < 0 or y_end > 64 or y_start + cmd1 < 0 or y_end + cmd1 > len(sprite):
+                    raise AssetError(f"Sprite {n} column {x} has a wrong post [{y_start}-{y_end}] at {y_start + cmd1}")
+                spans.append((x, y_start, y_end, y_start + cmd1))
+
+    return np.array(spans, dtype=sprite_span_dtype)
+
+
+def File_PML_CompileSprite(ctx: VSwapContext, n):
+    return or_none(compile_sprite, ctx, n)
 
-            i = cmd2 // 2 + cmd1
-            for y in range(cmd2 // 2, cmd0 // 2):
-                tmp[y * 64 + x] = sprite[i]
-                i += 1
+
+def sprite_indices(ctx: VSwapContext, n):
+    spans = compile_sprite(ctx, n)
+
+    # Initialize all as transparent
+    tmp = np.full((64, 64), 255, dtype=np.uint8)
+
+    # Expand the spans into one (y, x) <- source offset list and copy them in one go
+    lengths = spans["y_end"].astype(np.intp) - spans["y_start"]
+    steps = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    ys = np.repeat(spans["y_start"], lengths) + steps
+    xs = np.repeat(spans["column"], lengths)
+    src = np.repeat(spans["source_offset"], lengths) + steps
+    tmp[ys, xs] = np.frombuffer(page_view(ctx, n), dtype=np.uint8)[src]
+
+    return tmp
+
+
+def File_PML_LoadSpriteIndices(ctx: VSwapContext, n):
+    return or_none(sprite_indices, ctx, n)
+
+
+def File_PML_LoadSprite(ctx: VSwapContext, n, block, palette=WolfPal, bleed=1):
+    tmp = File_PML_LoadSpriteIndices(ctx, n)
+    if tmp is None:
+        return 0
 
     # Clear block before expanding palette
     block.clear()
 
     # Now expand the palette
-    Img_ExpandPalette(block, tmp, 64, 64, palette, True)
+    Img_ExpandPalette(block, tmp, 64, 64, palette, True, bleed)
 
     return 1
 
 
-def extract_vswap(vswap_path):
-    walls_path = Path("vswap/walls")
-    walls_path.mkdir(parents=True, exist_ok=True)
+def File_PML_LoadSprites(ctx: VSwapContext):
+    # All sprites as (N, 64, 64) palette indices and an opacity mask, unreadable sprites are empty
+    indices = np.full((ctx.SoundStart - ctx.SpriteStart, 64, 64), 255, dtype=np.uint8)
+    for i in range(ctx.SpriteStart, ctx.SoundStart):
+        sprite = File_PML_LoadSpriteIndices(ctx, i)
+        if sprite is not None:
+            indices[i - ctx.SpriteStart] = sprite
 
-    sprites_path = Path("vswap/sprites")
-    sprites_path.mkdir(parents=True, exist_ok=True)
+    return indices, indices != 255
 
-    digisounds_path = Path("vswap/digisounds")
-    digisounds_path.mkdir(parents=True, exist_ok=True)
 
-    spear = True if vswap_path.suffix.lower() == ".sod" else False
+def read_digimap(ctx: VSwapContext):
+    page = page_view(ctx, ctx.ChunksInFile - 1)
+    digimap = np.frombuffer(page, dtype=digimap_dtype, count=len(page) // digimap_dtype.itemsize)
 
-    ctx = VSwapContext()
-    ctx.names = gen_vswap_name_lookup_table(spear=spear)
+    # The list ends at the first entry starting at or past the digimap page itself
+    end = np.flatnonzero(digimap["start_page"].astype(np.intp) + ctx.SoundStart >= ctx.ChunksInFile - 1)
+    return digimap[:end[0]] if len(end) else digimap
+
+
+def File_PML_LoadDigiMap(ctx: VSwapContext):
+    return or_none(read_digimap, ctx)
+
+
+def sound_data(ctx: VSwapContext, start_page, length):
+    # A sound continues over the following pages until length bytes are read. Pages stored
+    # back to back in the file are returned as one view, otherwise the page views are joined once.
+    views = []
+    n = ctx.SoundStart + start_page
+    remaining = length
+    while remaining > 0:
+        if n >= ctx.ChunksInFile - 1:
+            raise AssetError(f"Sound at page {start_page} runs past the sound pages")
+        views.append(page_view(ctx, n)[:remaining])
+        remaining -= len(views[-1])
+        n += 1
+
+    first = ctx.SoundStart + start_page
+    if all(ctx.Pages[i].offset + ctx.Pages[i].length == ctx.Pages[i + 1].offset for i in range(first, n - 1)):
+        offset = ctx.Pages[first].offset
+        return ctx.view[offset:offset + length]
+
+    return b"".join(views)
+
+
+def File_PML_GetSound(ctx: VSwapContext, start_page, length):
+    return or_none(sound_data, ctx, start_page, length)
 
-    palette = SodPal if spear else WolfPal
+
+def vswap_names(vswap_path: Path):
+    # Sprite and digitized sound names of the game a page file belongs to
+    spear = is_spear_file(Path(vswap_path))
+    suffix = Path(vswap_path).suffix.lower()
+    return (gen_vswap_name_lookup_table(spear=spear),
+            gen_digisound_name_lookup_table(spear=spear, upload=suffix == ".wl1", speardemo=suffix == ".sdm"))
+
+
+def _open_vswap(vswap_path):
+    ctx = VSwapContext()
+    map_page_file(ctx, Path(vswap_path))
+    return ctx
+
+
+# Lazy iteration over one kind of asset, yielding (index, name, data). Only the selected items
+# are decoded, when they are consumed: select is a slice of the items, pattern a glob on their
+# names. Empty pages are skipped, others raise AssetError if they can't be decoded. The file
+# stays open until the generator is exhausted or closed.
+
+def iter_walls(vswap_path, select=None, pattern=None, expand=False):
+    # (64, 64) palette indices, or RGB with expand
+    palette = SodPal if is_spear_file(Path(vswap_path)) else WolfPal
+    with _open_vswap(vswap_path) as ctx:
+        names = [f"{i // 2}_shaded" if i % 2 else f"{i // 2}" for i in range(ctx.SpriteStart)]
+        for i in select_indices(names, select, pattern):
+            if ctx.Pages[i].length:
+                wall = wall_indices(ctx, i)
+                yield i, names[i], palette[wall] if expand else wall.copy()
+
+
+def iter_sprites(vswap_path, select=None, pattern=None, expand=False, bleed=1):
+    # (64, 64) palette indices with 255 as transparent, or RGBA with expand
+    palette = SodPal if is_spear_file(Path(vswap_path)) else WolfPal
+    sprite_names, _ = vswap_names(vswap_path)
+    with _open_vswap(vswap_path) as ctx:
+        names = [lookup_name(sprite_names, i) or str(i) for i in range(ctx.SoundStart - ctx.SpriteStart)]
+        for shapenum in select_indices(names, select, pattern):
+            if ctx.Pages[ctx.SpriteStart + shapenum].length:
+                sprite = sprite_indices(ctx, ctx.SpriteStart + shapenum)
+                data = Img_ExpandPaletteArray(sprite, 64, 64, palette, True, bleed) if expand else sprite
+                yield shapenum, names[shapenum], data
+
+
+def iter_sounds(vswap_path, select=None, pattern=None):
+    # 8-bit unsigned mono samples at digi_sample_rate, the name is None for sounds without one
+    _, sound_names = vswap_names(vswap_path)
+    with _open_vswap(vswap_path) as ctx:
+        digimap = read_digimap(ctx)
+        names = [lookup_name(sound_names, i) for i in range(len(digimap))]
+        for soundnum in select_indices(names, select, pattern):
+            start_page, length = digimap[soundnum].tolist()
+            if length:
+                yield soundnum, names[soundnum], np.frombuffer(sound_data(ctx, start_page, length), dtype=np.uint8).copy()
+
+
+def atlas_frame(x, y, w, h, atlas_w, atlas_h):
+    return {
+        "rect": [x, y, w, h],
+        "uv": [x / atlas_w, y / atlas_h, (x + w) / atlas_w, (y + h) / atlas_h],
+    }
+
+
+def export_vswap_atlas(ctx: VSwapContext, atlas_path: Path, wall_names, sprite_names, palette=WolfPal,
+                       sprite_bleed=1, indexed=False, writer: OutputWriter = None):
+    writer = writer or OutputWriter()
+    index = {}
+
+    # Walls (shaded variants included) on a grid of 64x64 cells, power-of-two wide
+    walls = File_PML_LoadWalls(ctx, None if indexed else palette)
+    cols = next_pow2(math.ceil(math.sqrt(max(len(walls), 1))))
+    rows = math.ceil(len(walls) / cols)
+    grid = np.zeros((rows * cols,) + walls.shape[1:], dtype=np.uint8)
+    grid[:len(walls)] = walls
+    # (rows * cols, 64, 64, ...) -> (rows * 64, cols * 64, ...)
+    grid = grid.reshape((rows, cols, 64, 64) + walls.shape[3:]).swapaxes(1, 2)
+    grid = grid.reshape((rows * 64, cols * 64) + walls.shape[3:])
+
+    atlas_h, atlas_w = grid.shape[:2]
+    index["walls"] = {
+        "texture": "walls.png",
+        "size": [atlas_w, atlas_h],
+        "frames": {
+            name: atlas_frame((i % cols) * 64, (i // cols) * 64, 64, 64, atlas_w, atlas_h)
+            for i, name in enumerate(wall_names)
+        },
+    }
+    writer.save_image(palette_image(grid, palette, True) if indexed else Image.fromarray(grid, 'RGB'),
+                      atlas_path / "walls.png")
+
+    # Sprites trimmed to their opaque pixels (plus the bleed border) and shelf packed
+    indices, opaque = File_PML_LoadSprites(ctx)
+    pad = 0 if indexed else sprite_bleed
+    rects = []
+    for mask in opaque:
+        ys, xs = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+        if not len(ys):
+            rects.append((0, 0, 0, 0))
+            continue
+        x0, y0 = max(xs[0] - pad, 0), max(ys[0] - pad, 0)
+        x1, y1 = min(xs[-1] + 1 + pad, 64), min(ys[-1] + 1 + pad, 64)
+        rects.append((int(x0), int(y0), int(x1 - x0), int(y1 - y0)))
+
+    packed = [i for i, r in enumerate(rects) if r[2]]
+    side, positions = pack_pow2_square([rects[i][2:] for i in packed], spacing=1)
+
+    if indexed:
+        atlas = np.full((side, side), 255, dtype=np.uint8)
+    else:
+        atlas = np.zeros((side, side, 4), dtype=np.uint8)
+
+    frames = {}
+    for i, (x, y) in zip(packed, positions):
+        x0, y0, w, h = rects[i]
+        if indexed:
+            sprite = indices[i]
+        else:
+            sprite = Img_ExpandPaletteArray(indices[i], 64, 64, palette, True, sprite_bleed)
+        atlas[y:y + h, x:x + w] = sprite[y0:y0 + h, x0:x0 + w]
+
+        name = sprite_names[i] if i < len(sprite_names) else str(i)
+        frame = atlas_frame(x, y, w, h, side, side)
+        # Offset of the trimmed rect in the 64x64 shape, pivot is the bottom center of the shape
+        frame["offset"] = [x0, y0]
+        frame["pivot"] = [32 - x0, 64 - y0]
+        frames[name] = frame
+
+    index["sprites"] = {
+        "texture": "sprites.png",
+        "size": [side, side],
+        "source_size": [64, 64],
+        "frames": frames,
+    }
+    writer.save_image(palette_image(atlas, palette, True, transparent=255) if indexed else
+                      Image.fromarray(atlas, 'RGBA'), atlas_path / "sprites.png")
+
+    writer.write_text(atlas_path / "atlas.json", json.dumps(index, indent=1))
+
+
+def extract_vswap(vswap_path, sprite_bleed=1, indexed=False, atlas=False, sound_rate=None, sound_format="int16",
+                  parts=vswap_parts, shard=None, output_root: Path = Path("."), writer: OutputWriter = None):
+    # shard (k, n) limits sprites to part k of n, atlases are never split. Outputs are written below output_root.
+    ctx = VSwapContext()
 
     if not os.path.isfile(vswap_path):
-        print(f"Error: Input file not found: {vswap_path}")
-        sys.exit(1)
+        raise AssetError(f"Input file not found: {vswap_path}")
 
     if not File_PML_OpenPageFile(ctx, vswap_path):
-        print("Failed to open page file.")
-        sys.exit(1)
+        raise AssetError(f"Failed to open page file: {vswap_path}")
+
+    # Page views made while extracting are released when the helper returns, before the file closes
+    with ctx:
+        _extract_vswap_pages(ctx, vswap_path, sprite_bleed, indexed, atlas, sound_rate, sound_format, parts, shard,
+                             Path(output_root), writer)
+
+
+def _extract_vswap_pages(ctx: VSwapContext, vswap_path, sprite_bleed=1, indexed=False, atlas=False, sound_rate=None,
+                         sound_format="int16", parts=vswap_parts, shard=None, output_root: Path = Path("."),
+                         writer: OutputWriter = None):
+    writer = writer or OutputWriter()
+
+    walls_path = output_root / "vswap/walls"
+    sprites_path = output_root / "vswap/sprites"
+    if not atlas and "walls" in parts:
+        walls_path.mkdir(parents=True, exist_ok=True)
+    if not atlas and "sprites" in parts:
+        sprites_path.mkdir(parents=True, exist_ok=True)
+
+    digisounds_path = output_root / "vswap/digisounds"
+    if "sounds" in parts:
+        digisounds_path.mkdir(parents=True, exist_ok=True)
+
+    spear = is_spear_file(vswap_path)
+    ctx.names, sound_names = vswap_names(vswap_path)
+
+    palette = SodPal if spear else WolfPal
 
     # Ensure a leading zero
     def get_formant(n: int):
         return f"{{:0{int(math.log10(n)) + 1}d}}"
 
-    idx_formant = get_formant(math.ceil((ctx.SpriteStart - 1) / 2))
-    for i in range(ctx.SpriteStart):
-        block = bytearray(64 * 64 * 3)
-        if File_PML_LoadWall(ctx, i, block, palette):
-            im = Image.frombytes('RGB', (64, 64), block, 'raw')
-            idx, shaded = divmod(i, 2)  # every second texture is a shaded variant
-            idx_str = idx_formant.format(idx)
-            im.save(walls_path / f"{idx_str}.png" if shaded == 0 else walls_path / f"{idx_str}_shaded.png")
-        else:
-            print(f"Failed to load wall {i}.")
-
-    idx_formant = get_formant(ctx.SoundStart - ctx.SpriteStart - 1)
-    for i in range(ctx.SpriteStart, ctx.SoundStart):
-        block = bytearray(64 * 64 * 4)
-        if File_PML_LoadSprite(ctx, i, block, palette):
-            im = Image.frombytes('RGBA', (64, 64), block, 'raw')
-            shapenum = i - ctx.SpriteStart
-            shapenum_str = idx_formant.format(shapenum)
-            im.save(sprites_path / f"{shapenum_str}_{ctx.names[shapenum]}.png")
-        else:
-            print(f"Failed to load sprite {i}.")
-
-    digimap_n = ctx.ChunksInFile - 1
-    digimap = bytearray(ctx.Pages[digimap_n].length)
-    if not File_PML_ReadPage(ctx, digimap_n, digimap):
-        print("Failed to load digimap page.")
-        sys.exit(1)
-
-    with open(digisounds_path / "digimap.bin", "wb") as digimap_file:
-        digimap_file.write(digimap)
-
-    idx_formant = get_formant(digimap_n - ctx.SoundStart - 1)
-    for i in range(ctx.SoundStart, digimap_n):
-        block = bytearray(ctx.Pages[i].length)
-        soundnum = i - ctx.SoundStart
-        if not File_PML_ReadPage(ctx, i, block):
+    wall_formant = get_formant(math.ceil((ctx.SpriteStart - 1) / 2))
+    sprite_formant = get_formant(ctx.SoundStart - ctx.SpriteStart - 1)
+
+    if atlas and ("walls" in parts or "sprites" in parts):
+        atlas_path = output_root / "vswap/atlas"
+        atlas_path.mkdir(parents=True, exist_ok=True)
+
+        # Same names as the single file output
+        wall_names = [f"{wall_formant.format(i // 2)}{'_shaded' if i % 2 else ''}" for i in range(ctx.SpriteStart)]
+        # Views into the page file, released before it closes
+        pages = [ctx.view[page.offset:page.offset + page.length] for page in ctx.Pages[:ctx.SoundStart]]
+        unchanged = writer.unchanged([atlas_path / "walls.png", atlas_path / "sprites.png", atlas_path / "atlas.json"],
+                                     *pages, palette, sprite_bleed, indexed, wall_names, ctx.names)
+        for page in pages:
+            page.release()
+        if not unchanged:
+            export_vswap_atlas(ctx, atlas_path, wall_names, ctx.names, palette, sprite_bleed, indexed, writer)
+    elif not atlas:
+        if "walls" in parts:
+            for i in range(ctx.SpriteStart):
+                idx, shaded = divmod(i, 2)  # every second texture is a shaded variant
+                idx_str = wall_formant.format(idx)
+                wall_file = walls_path / f"{idx_str}.png" if shaded == 0 else walls_path / f"{idx_str}_shaded.png"
+                page = File_PML_GetPage(ctx, i)
+                if page is not None and writer.unchanged([wall_file], page, palette, indexed):
+                    continue
+
+                wall = File_PML_LoadWallIndices(ctx, i)
+                if wall is not None:
+                    im = palette_image(wall, palette, indexed)
+                    writer.save_image(im, wall_file)
+                else:
+                    print(f"Failed to load wall {i}.")
+
+        if "sprites" in parts:
+            for shapenum in shard_range(ctx.SoundStart - ctx.SpriteStart, shard):
+                i = ctx.SpriteStart + shapenum
+                shapenum_str = sprite_formant.format(shapenum)
+                sprite_file = sprites_path / f"{shapenum_str}_{ctx.names[shapenum]}.png"
+                page = File_PML_GetPage(ctx, i)
+                if page is not None and writer.unchanged([sprite_file], page, palette, indexed, sprite_bleed):
+                    continue
+
+                if indexed:
+                    sprite = File_PML_LoadSpriteIndices(ctx, i)
+                    # Index 255 is transparent
+                    im = palette_image(sprite, palette, True, transparent=255) if sprite is not None else None
+                else:
+                    block = bytearray(64 * 64 * 4)
+                    ok = File_PML_LoadSprite(ctx, i, block, palette, sprite_bleed)
+                    im = Image.frombytes('RGBA', (64, 64), block, 'raw') if ok else None
+                if im is not None:
+                    writer.save_image(im, sprite_file)
+                else:
+                    print(f"Failed to load sprite {i}.")
+
+    if "sounds" not in parts:
+        return
+
+    digimap = File_PML_LoadDigiMap(ctx)
+    if digimap is None:
+        raise AssetError("Failed to load digimap page")
+
+    digimap_file = digisounds_path / "digimap.bin"
+    with File_PML_GetPage(ctx, ctx.ChunksInFile - 1) as page:
+        if not writer.unchanged([digimap_file], page):
+            writer.write_bytes(digimap_file, bytes(page))
+
+    resample = sound_rate is not None
+    if not resample:
+        # Original samples, written as they are stored
+        sound_rate, sound_format = digi_sample_rate, "u8"
+
+    idx_formant = get_formant(max(len(digimap) - 1, 1))
+    sound_files, sounds = [], []
+    for soundnum, (start_page, length) in enumerate(digimap):
+        if not length:
+            continue
+        name = lookup_name(sound_names, soundnum)
+        soundnum_str = idx_formant.format(soundnum)
+        sound_file = digisounds_path / (f"{soundnum_str}_{name}.wav" if name else f"{soundnum_str}.wav")
+
+        sound = File_PML_GetSound(ctx, int(start_page), int(length))
+        if sound is None:
             print(f"Failed to load sound {soundnum}.")
-        with open(digisounds_path / f"{idx_formant.format(soundnum)}.bin", "wb") as sound_file:
-            sound_file.write(block)
+            continue
+        if writer.unchanged([sound_file], sound, sound_rate, sound_format):
+            continue
+        sound_files.append(sound_file)
+        sounds.append(sound)
+
+    if resample:
+        sounds = resample_sounds(sounds, digi_sample_rate, sound_rate, sound_format)
+
+    for sound_file, sound in zip(sound_files, sounds):
+        writer.write_bytes(sound_file, wav_bytes(sound, sound_rate, sound_format))
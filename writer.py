@@ -0,0 +1,102 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from manifest import source_hash
+
+
+class OutputWriter:
+    # Encodes and writes output files on a thread pool, so decoding doesn't wait on zlib or the disk.
+    # At most queue_depth jobs are pending, submit blocks beyond that. With workers=0 every job runs
+    # inline. Errors are raised from the next submit or from flush().
+    # With an ExtractManifest, outputs made from unchanged sources can be skipped, see unchanged().
+    def __init__(self, workers=0, queue_depth=64, manifest=None):
+        self.manifest = manifest
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.slots = threading.BoundedSemaphore(max(queue_depth, 1))
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.errors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(wait=exc_type is None)
+
+    def _done(self, future):
+        self.slots.release()
+        with self.lock:
+            self.pending.discard(future)
+            # Writes dropped by close(wait=False) after a failed stage, not an error of their own
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self.errors.append(future.exception())
+
+    def _raise_errors(self):
+        with self.lock:
+            errors, self.errors = self.errors, []
+        if errors:
+            raise errors[0]
+
+    def unchanged(self, paths, *sources):
+        # True if the outputs at paths exist and were made from the same sources in the last run.
+        # Nothing is hashed without a manifest.
+        if self.manifest is None:
+            return False
+        return self.manifest.unchanged(paths, source_hash(*sources))
+
+    def submit(self, fn, *args):
+        self._raise_errors()
+        if self.executor is None:
+            fn(*args)
+            return
+
+        self.slots.acquire()
+        future = self.executor.submit(fn, *args)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self._done)
+
+    def save_image(self, im, path: Path, **params):
+        # PIL's PNG encoder releases the GIL while compressing
+        self.submit(_save_image, im, path, params)
+
+    def write_bytes(self, path: Path, data):
+        self.submit(_write_bytes, path, data)
+
+    def write_text(self, path: Path, text: str):
+        self.submit(_write_text, path, text)
+
+    def flush(self):
+        while True:
+            with self.lock:
+                pending = list(self.pending)
+            if not pending:
+                break
+            for future in pending:
+                # Errors are collected by _done
+                future.exception()
+        self._raise_errors()
+
+    def close(self, wait=True):
+        if wait:
+            self.flush()
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, cancel_futures=not wait)
+            self.executor = None
+
+
+def _save_image(im, path, params):
+    im.save(path, **params)
+
+
+def _write_bytes(path, data):
+    with open(path, 'wb') as fp:
+        fp.write(data)
+
+
+def _write_text(path, text):
+    with open(path, 'w') as fp:
+        fp.write(text)